@@ -0,0 +1,5 @@
+"""
+Benchmarks of the hot paths of the app, to check their speed against the
+figures of the changes that optimised them. Run them from the root of the
+repository, e.g. `python -m benchmarks.geometry`.
+"""
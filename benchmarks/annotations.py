@@ -0,0 +1,50 @@
+"""
+Saves of annotations through `/api/image/annotate`, each adding a given
+number of polygons to an image, in saves per second.
+"""
+import argparse
+from http import HTTPStatus
+import shutil
+import time
+
+from . import workspace
+
+# a region of the annotations: a triangle in the synthetic images
+POINTS = [{'x': 1, 'y': 1}, {'x': 60, 'y': 2}, {'x': 30, 'y': 45}]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--annotations', type=int, nargs='+', default=[10, 100, 1000],
+                        help='numbers of annotations per save')
+    parser.add_argument('--duration', type=float, default=3, help='seconds of saves per number')
+    parser.add_argument('--config', default='production', help='configuration of the app')
+    args = parser.parse_args()
+    work_directory = workspace.make_work_directory()
+    try:
+        workspace.make_bank(work_directory, 'synthetic', 100)
+        app = workspace.create_app(work_directory, args.config, STARTUP_DISCOVERY='sync')
+        client = app.test_client()
+        workspace.login(client)
+        bank_id = client.get('/api/bank-list').json[0]['id']
+        image_ids = [image['id'] for image in client.get(f'/api/bank/{bank_id}').json['images']]
+        for count in args.annotations:
+            annotations = [{'id': -1, 'points': POINTS, 'tag': {'start': 0, 'end': 8}} for _ in range(count)]
+            saves = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < args.duration:
+                response = client.post('/api/image/annotate', json={
+                    'imageId': str(image_ids[saves % len(image_ids)]),
+                    'annotations': annotations,
+                })
+                assert response.status_code == HTTPStatus.OK, response.data
+                saves += 1
+            elapsed = time.perf_counter() - start
+            print(f'{count} annotations per save: {saves / elapsed:.1f} saves/s, '
+                  f'{saves * count / elapsed:.0f} annotations/s')
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
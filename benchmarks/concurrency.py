@@ -0,0 +1,78 @@
+"""
+Annotators working in parallel on the same database: each writer process
+runs its own app, as a server worker would, and saves annotations then
+views the image, in a loop. Prints the saves per second and the failed
+requests (eg "database is locked") for each number of writers.
+"""
+import argparse
+import contextlib
+from http import HTTPStatus
+import io
+import multiprocessing
+import shutil
+import time
+
+from . import workspace
+
+# annotations of a save
+ANNOTATIONS = [{'id': -1, 'points': [{'x': 1, 'y': 1}, {'x': 60, 'y': 2}, {'x': 30, 'y': 45}],
+                'tag': {'start': 0, 'end': 8}}] * 3
+BANK_SIZE = 50
+
+
+def writer(work_directory, config_name, index, duration):
+    """
+    Returns the numbers of successful and failed saves of a writer.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        app = workspace.create_app(work_directory, config_name, STARTUP_DISCOVERY='off')
+    # the processes of a pool cannot have the password pool's processes
+    app.config['PASSWORD_WORKERS'] = 0
+    client = app.test_client()
+    workspace.login(client)
+    saves = failures = 0
+    end = time.perf_counter() + duration
+    i = 0
+    while time.perf_counter() < end:
+        # the writers work on different images
+        image_id = 1 + (index * 7 + i) % BANK_SIZE
+        i += 1
+        try:
+            response = client.post('/api/image/annotate', json={'imageId': str(image_id), 'annotations': ANNOTATIONS})
+            if response.status_code == HTTPStatus.OK:
+                saves += 1
+            else:
+                failures += 1
+        except Exception:
+            failures += 1
+        client.get(f'/api/image/{image_id}')
+    return saves, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--writers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--duration', type=float, default=5, help='seconds of saves per number of writers')
+    parser.add_argument('--config', default='production', help='configuration of the app')
+    args = parser.parse_args()
+    work_directory = workspace.make_work_directory()
+    try:
+        workspace.make_bank(work_directory, 'synthetic', BANK_SIZE)
+        # creates the database and discovers the bank
+        with contextlib.redirect_stdout(io.StringIO()):
+            workspace.create_app(work_directory, args.config, STARTUP_DISCOVERY='sync')
+        context = multiprocessing.get_context('spawn')
+        for writers in args.writers:
+            with context.Pool(writers) as pool:
+                results = pool.starmap(writer, [(work_directory, args.config, index, args.duration)
+                                                for index in range(writers)])
+            saves = sum(saves for saves, _ in results)
+            failures = sum(failures for _, failures in results)
+            print(f'{args.config}, {writers} writers: {saves / args.duration:.1f} saves/s, '
+                  f'{saves * len(ANNOTATIONS) / args.duration:.0f} annotations/s, {failures} failed saves')
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Discovery of a new bank of synthetic JPEG images: the dimensions probed
+from the JPEG headers in parallel and the images inserted by chunks,
+against the former way (`PIL.Image.open` and one `db.session.add` per
+image).
+"""
+import argparse
+import os
+import shutil
+import time
+
+from . import workspace
+
+
+def former_import(bank_id, bank_path, names):
+    """
+    Inserts the given images of a bank as the former `discover_bank` did.
+    """
+    from PIL import Image
+    from website.database.access import db
+    from website.database.models import ImageToAnnotate
+    for name in names:
+        with open(os.path.join(bank_path, os.path.splitext(name)[0] + '.txt'), 'r') as file:
+            description = file.read().split('\n')[3]
+        width, height = Image.open(os.path.join(bank_path, name)).size
+        db.session.add(ImageToAnnotate(bank_id, 'former/' + name, description, width, height))
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--images', type=int, default=10000, help='number of images of the bank')
+    parser.add_argument('--image-size', type=int, nargs=2, default=[640, 480], metavar=('WIDTH', 'HEIGHT'))
+    args = parser.parse_args()
+    work_directory = workspace.make_work_directory()
+    try:
+        print(f'> generating {args.images} images')
+        bank_path = workspace.make_bank(work_directory, 'synthetic', args.images, tuple(args.image_size))
+        app = workspace.create_app(work_directory, STARTUP_DISCOVERY='off')
+        from PIL import Image
+        from website.database.access import db
+        from website.database.models import ImageBank
+        from website.images.discovery import discover_bank, get_all_dimensions
+        names = sorted(name for name in os.listdir(bank_path) if name.endswith('.jpg'))
+        paths = [os.path.join(bank_path, name) for name in names]
+        with app.app_context():
+            start = time.perf_counter()
+            former_dimensions = [Image.open(path).size for path in paths]
+            former_probe = time.perf_counter() - start
+            start = time.perf_counter()
+            dimensions = get_all_dimensions(paths)
+            probe = time.perf_counter() - start
+            assert dimensions == former_dimensions
+            print(f'dimensions: PIL {former_probe:.2f} s, headers {probe:.2f} s (x{former_probe / probe:.1f})')
+
+            bank = ImageBank('former', '')
+            db.session.add(bank)
+            db.session.commit()
+            start = time.perf_counter()
+            former_import(bank.id, bank_path, names)
+            former_discovery = time.perf_counter() - start
+            start = time.perf_counter()
+            discover_bank(bank_path + os.sep)
+            discovery = time.perf_counter() - start
+            print(f'discovery: former {former_discovery:.2f} s, current {discovery:.2f} s '
+                  f'(x{former_discovery / discovery:.1f})')
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
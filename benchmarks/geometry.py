@@ -0,0 +1,84 @@
+"""
+Validation of large annotation regions, as `save_annotations` does it:
+parsing the JSON points, checking them against the image's bounds and
+serializing them, with `PolygonalRegion` (with and without NumPy) and with
+one `Point` object per vertex (the former way); and their simplification.
+
+The computations over the coordinate array (the bounds check, the
+simplification) gain an order of magnitude or more with NumPy, but the
+whole validation only a few times: parsing the JSON points reads one dict
+per vertex in Python, which the arrays cannot avoid and which dominates.
+The parse line reports that share.
+"""
+import argparse
+import random
+import timeit
+
+from website.images import geometry
+from website.images.geometry import Point, PolygonalRegion
+
+WIDTH, HEIGHT = 4000, 3000
+
+
+def points_out_of_bounds(points):
+    return max(map(lambda p: p.x, points)) > WIDTH or min(map(lambda p: p.x, points)) < 0 \
+        or max(map(lambda p: p.y, points)) > HEIGHT or min(map(lambda p: p.y, points)) < 0
+
+
+def validate_points(raw):
+    points = [Point(p['x'], p['y']) for p in raw]
+    return points_out_of_bounds(points), ';'.join(point.sql_serialize() for point in points)
+
+
+def validate_region(raw):
+    region = PolygonalRegion.deserialize_from_json(raw)
+    return not region.within(WIDTH, HEIGHT), region.coords()
+
+
+def parse_region(raw):
+    return PolygonalRegion.deserialize_from_json(raw)
+
+
+def best_time(function, number):
+    """
+    Returns the best time of a call of `function()`, in milliseconds.
+    """
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--vertices', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--number', type=int, default=20, help='calls per timing')
+    parser.add_argument('--tolerance', type=float, default=2, help='tolerance of the simplification, in pixels')
+    args = parser.parse_args()
+    numpy = geometry.numpy
+    print(f'NumPy: {"available" if numpy is not None else "not installed"}')
+    for vertices in args.vertices:
+        raw = [{'x': random.randint(0, WIDTH), 'y': random.randint(0, HEIGHT)} for _ in range(vertices)]
+        points = [Point(p['x'], p['y']) for p in raw]
+        validation = best_time(lambda: validate_points(raw), args.number)
+        check = best_time(lambda: points_out_of_bounds(points), args.number)
+        print(f'{vertices} vertices, Point objects: validation {validation:.3f} ms, bounds check {check:.3f} ms')
+        for name, module in (('NumPy', numpy), ('array', None)):
+            if name == 'NumPy' and numpy is None:
+                continue
+            # the coordinate arrays are built by `to_coord_array` from the module's `numpy`
+            geometry.numpy = module
+            try:
+                region = PolygonalRegion.deserialize_from_json(raw)
+                region_validation = best_time(lambda: validate_region(raw), args.number)
+                region_parse = best_time(lambda: parse_region(raw), args.number)
+                region_check = best_time(lambda: region.within(WIDTH, HEIGHT), args.number)
+                simplification = best_time(lambda: region.simplify(args.tolerance), args.number)
+            finally:
+                geometry.numpy = numpy
+            print(f'{vertices} vertices, PolygonalRegion ({name}): '
+                  f'validation {region_validation:.3f} ms (x{validation / region_validation:.1f}, '
+                  f'parse {region_parse / region_validation:.0%} of it), '
+                  f'bounds check {region_check:.3f} ms (x{check / region_check:.1f}), '
+                  f'simplification {simplification:.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+The annotation hot loop of a logged-in user: viewing an image and saving
+an annotation, image after image. Prints the SQL queries per request
+and the requests per second, with the user and permission caches and
+without them (`USER_CACHE_TTL` and `PERMISSION_CACHE_TTL` set to 0, so that
+the user and its accesses are loaded by each request).
+"""
+import argparse
+from http import HTTPStatus
+import shutil
+import time
+
+from . import workspace
+
+POINTS = [{'x': 1, 'y': 1}, {'x': 60, 'y': 2}, {'x': 30, 'y': 45}]
+
+
+def run_loop(client, image_ids, images):
+    """
+    Returns the number of requests and of queries of the loop over the
+    given number of images.
+    """
+    requests = queries = 0
+    for i in range(images):
+        image_id = image_ids[i % len(image_ids)]
+        response = client.get(f'/api/image/{image_id}')
+        assert response.status_code == HTTPStatus.OK, response.data
+        queries += int(response.headers['X-Query-Count'])
+        response = client.post('/api/image/annotate', json={
+            'imageId': str(image_id),
+            'annotations': [{'id': -1, 'points': POINTS, 'tag': {'start': 0, 'end': 8}}],
+        })
+        assert response.status_code == HTTPStatus.OK, response.data
+        queries += int(response.headers['X-Query-Count'])
+        requests += 2
+    return requests, queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--images', type=int, default=200, help='number of images annotated')
+    args = parser.parse_args()
+    work_directory = workspace.make_work_directory()
+    try:
+        workspace.make_bank(work_directory, 'synthetic', 60)
+        app = workspace.create_app(work_directory, COUNT_QUERIES='1')
+        from website.database.permissions import permission_cache
+        from website.database.users import user_cache
+        client = app.test_client()
+        workspace.login(client)
+        bank_id = client.get('/api/bank-list').json[0]['id']
+        image_ids = [image['id'] for image in client.get(f'/api/bank/{bank_id}').json['images']]
+        ttls = app.config['USER_CACHE_TTL'], app.config['PERMISSION_CACHE_TTL']
+        for name, (user_ttl, permission_ttl) in (('without caches', (0, 0)), ('with caches', ttls)):
+            app.config['USER_CACHE_TTL'], app.config['PERMISSION_CACHE_TTL'] = user_ttl, permission_ttl
+            # forgets the entries cached by the login
+            user_cache.invalidate_where(lambda user: True)
+            permission_cache.invalidate_where(lambda levels: True)
+            start = time.perf_counter()
+            requests, queries = run_loop(client, image_ids, args.images)
+            elapsed = time.perf_counter() - start
+            print(f'{name}: {queries / requests:.2f} queries per request, '
+                  f'{requests / elapsed:.0f} requests/s')
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+A burst of logins on a threaded server, while an annotator views images:
+prints the logins per second, their statuses (503 when the password pool's
+queue is full) and the latency of the image views, with the passwords
+hashed by the request threads (`PASSWORD_WORKERS` set to 0) and by the
+password pool.
+"""
+import argparse
+import http.cookiejar
+import json
+import logging
+import shutil
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from werkzeug.serving import make_server
+
+from . import workspace
+
+
+def make_opener():
+    return urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+
+def post(opener, url, body):
+    """
+    Returns the status of a JSON POST request.
+    """
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), headers={'Content-Type': 'application/json'})
+    try:
+        with opener.open(request) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def run_burst(base_url, users, duration):
+    """
+    Returns the statuses of the logins of the given users, in a loop, and
+    the latencies of the image views meanwhile.
+    """
+    end = time.perf_counter() + duration
+    statuses = {}
+    latencies = []
+    viewer = make_opener()
+    assert post(viewer, base_url + '/login', {'username': 'admin', 'password': 'admin'}) == 200
+
+    def log_in(username):
+        while time.perf_counter() < end:
+            status = post(make_opener(), base_url + '/login', {'username': username, 'password': 'password'})
+            statuses[status] = statuses.get(status, 0) + 1
+
+    def view():
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            with viewer.open(base_url + '/api/image/1') as response:
+                response.read()
+            latencies.append(time.perf_counter() - start)
+            time.sleep(0.02)
+
+    threads = [threading.Thread(target=log_in, args=(username,)) for username in users]
+    threads.append(threading.Thread(target=view))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses, sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=8, help='number of users logging in at once')
+    parser.add_argument('--duration', type=float, default=8, help='seconds of each burst')
+    parser.add_argument('--config', default='development', help='configuration of the app')
+    args = parser.parse_args()
+    work_directory = workspace.make_work_directory()
+    try:
+        workspace.make_bank(work_directory, 'synthetic', 5)
+        app = workspace.create_app(work_directory, args.config)
+        # without a log line per request
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+        users = [f'user{i}' for i in range(args.users)]
+        opener = make_opener()
+        for username in users:
+            post(opener, base_url + '/register', {'username': username, 'email': username + '@example.com',
+                                                  'password': 'password'})
+            post(opener, base_url + '/logout', {})
+        workers = app.config['PASSWORD_WORKERS']
+        for name, password_workers in (('request threads', 0), (f'pool of {workers}', workers)):
+            app.config['PASSWORD_WORKERS'] = password_workers
+            statuses, latencies = run_burst(base_url, users, args.duration)
+            logins = statuses.get(200, 0)
+            print(f'{name}: {logins / args.duration:.1f} logins/s, statuses {statuses}, image view '
+                  f'p50 {statistics.median(latencies) * 1000:.0f} ms, '
+                  f'p95 {latencies[int(len(latencies) * 0.95)] * 1000:.0f} ms')
+        server.shutdown()
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
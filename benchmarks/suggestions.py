@@ -0,0 +1,74 @@
+"""
+Termlist suggestions of descriptions of growing sizes, found by the
+`SuggestionEngine` and by the former character-walking loop (with the
+termlists as plain lists), which must give the same spans.
+"""
+import argparse
+from itertools import takewhile
+import random
+import timeit
+
+from website.textproc.proc import adj_list, pattern_list, suggestion_engine
+
+# words of the generated descriptions, besides the terms
+FILLER_WORDS = ['the', 'wing', 'forewing', 'with', 'and', 'a', 'near', 'base', 'margin', 'cell', 'brown-ish']
+SEPARATORS = [' ', ' ', ' ', ', ', '; ', '. ']
+
+
+def former_spans(adjectives, patterns, description):
+    """
+    The spans found by `get_keywords` before the `SuggestionEngine`.
+    """
+    spans = []
+    start_index = -1
+    i = 0
+    while i < len(description):
+        curr = description[i]
+        if curr.isalpha():
+            word = ''.join(list(takewhile(lambda c: c.isalpha() or c == '-', description[i:]))).lower()
+            if word in adjectives and start_index == -1:
+                start_index = i
+            elif word in patterns and start_index != -1:
+                spans.append((start_index, i + len(word)))
+                start_index = -1
+            i += len(word)
+        elif (curr == ';' or curr == '.') and start_index != -1:
+            spans.append((start_index, i))
+            start_index = -1
+            i += 1
+        else:
+            i += 1
+    return spans
+
+
+def make_description(size):
+    words = adj_list + pattern_list + FILLER_WORDS * 20
+    parts = []
+    length = 0
+    while length < size:
+        part = random.choice(words) + random.choice(SEPARATORS)
+        parts.append(part)
+        length += len(part)
+    return ''.join(parts)[:size]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='sizes of the descriptions, in characters')
+    parser.add_argument('--number', type=int, default=3, help='calls per timing')
+    args = parser.parse_args()
+    for size in args.sizes:
+        description = make_description(size)
+        spans = suggestion_engine.find_spans(description)
+        assert spans == former_spans(adj_list, pattern_list, description)
+        engine_time = min(timeit.repeat(lambda: suggestion_engine.find_spans(description),
+                                        number=args.number, repeat=5)) / args.number * 1000
+        former_time = min(timeit.repeat(lambda: former_spans(adj_list, pattern_list, description),
+                                        number=args.number, repeat=3)) / args.number * 1000
+        print(f'{size} characters, {len(spans)} spans: engine {engine_time:.3f} ms, '
+              f'former loop {former_time:.1f} ms (x{former_time / engine_time:.0f})')
+
+
+if __name__ == '__main__':
+    main()
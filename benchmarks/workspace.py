@@ -0,0 +1,66 @@
+"""
+Temporary work folders for the benchmarks that run the app. The app reads
+its termlists, banks and avatars from the current folder when imported, so
+`create_app` must be called before any other import of `website`.
+"""
+from http import HTTPStatus
+import os
+import shutil
+import sys
+import tempfile
+
+from PIL import Image
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DESCRIPTION = 'Forewing with dark brown spots and a pale band; hindwing with orange eyespots.'
+
+
+def make_work_directory():
+    """
+    Returns a new temporary folder holding a copy of the termlists and the
+    default avatar.
+    """
+    directory = tempfile.mkdtemp(prefix='butterfly-benchmark-')
+    shutil.copytree(os.path.join(repository, 'termlist'), os.path.join(directory, 'termlist'))
+    shutil.copytree(os.path.join(repository, 'avatars'), os.path.join(directory, 'avatars'))
+    return directory
+
+
+def make_bank(work_directory, name, size, image_size=(64, 48)):
+    """
+    Creates a bank of `size` JPEG images with their text files, and returns
+    its path.
+    """
+    bank_path = os.path.join(work_directory, 'banks', name)
+    os.makedirs(bank_path)
+    with open(os.path.join(bank_path, 'description.txt'), 'w') as file:
+        file.write(f'{name} bank')
+    image = Image.new('RGB', image_size, 'brown')
+    for i in range(size):
+        image.save(os.path.join(bank_path, f'image{i}.jpg'))
+        with open(os.path.join(bank_path, f'image{i}.txt'), 'w') as file:
+            file.write(f'{name} {i}\nspecies\nlocation\n{DESCRIPTION}\n')
+    return bank_path
+
+
+def create_app(work_directory, config_name='testing', **variables):
+    """
+    Imports the app in the given work folder, with its own SQLite database,
+    and returns it.
+
+    :param config_name: the configuration of the app (`APP_CONFIG`)
+    :param variables: other environment variables read by the configuration
+        (eg `STARTUP_DISCOVERY='off'`)
+    """
+    os.chdir(work_directory)
+    os.environ['APP_CONFIG'] = config_name
+    os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(work_directory, 'butterfly.db'))
+    os.environ.update(variables)
+    sys.path.insert(0, repository)
+    from website.app import app
+    return app
+
+
+def login(client, username='admin', password='admin'):
+    response = client.post('/login', json={'username': username, 'password': password})
+    assert response.status_code == HTTPStatus.OK, response.data
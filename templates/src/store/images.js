@@ -1,5 +1,24 @@
 import axios from 'axios'
 
+// images prefetched by the annotation sessions, by id: they are kept in the
+// session storage as moving to another image reloads the page
+const SESSION_STORAGE_KEY = 'annotationSession'
+// number of images fetched at once, and time during which they can be used
+const SESSION_SIZE = 5
+const SESSION_MAX_AGE = 60 * 1000
+
+function loadSession() {
+    try {
+        return JSON.parse(sessionStorage.getItem(SESSION_STORAGE_KEY)) || {}
+    } catch (e) {
+        return {}
+    }
+}
+
+function storeSession(session) {
+    sessionStorage.setItem(SESSION_STORAGE_KEY, JSON.stringify(session))
+}
+
 const actions = {
     listBanks({dispatch}) {
         return axios.get('/api/bank-list')
@@ -14,9 +33,30 @@ const actions = {
         return axios.put('/api/bank-access', {targetName: targetUser, level, id: bankId})
     },
     fetchImageData({dispatch}, {imageId}) {
-        return axios.get('/api/image/' + imageId)
+        const session = loadSession()
+        const prefetched = session[imageId]
+        if (prefetched && Date.now() - prefetched.fetchedAt < SESSION_MAX_AGE) {
+            delete session[imageId]
+            storeSession(session)
+            return Promise.resolve({data: prefetched.data})
+        }
+        return axios.get('/api/image/' + imageId + '/session', {params: {count: SESSION_SIZE}}).then(res => {
+            const fetchedAt = Date.now()
+            const next = {}
+            res.data.images.slice(1).forEach(image => {
+                next[image.id] = {data: image, fetchedAt}
+                // start downloading the image files too
+                new Image().src = axios.defaults.baseURL + '/api/' + image.imageUrl
+            })
+            storeSession(next)
+            return {data: res.data.images[0]}
+        })
     },
     sendAnnotations({dispatch}, {data}) {
+        // the prefetched data of the image is outdated
+        const session = loadSession()
+        delete session[data.imageId]
+        storeSession(session)
         return axios.post('/api/image/annotate', data)
     },
     requestBankJson({dispatch}, {bankId}) {
@@ -33,6 +73,9 @@ const actions = {
     deleteBank({dispatch}, {bankId}) {
         return axios.get('/api/bank/delete/' + bankId)
     },
+    fetchJob({dispatch}, {jobId}) {
+        return axios.get('/api/jobs/' + jobId)
+    },
 }
 
 export default {
@@ -0,0 +1,72 @@
+"""
+Fixtures of the tests. The app reads its termlists, banks and avatars from
+the current folder when imported: it is created once, with the 'testing'
+configuration, in a temporary folder holding a copy of them and two banks.
+"""
+from http import HTTPStatus
+import os
+import shutil
+import sys
+import tempfile
+
+from PIL import Image
+import pytest
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+work_directory = tempfile.mkdtemp(prefix='butterfly-tests-')
+# number of images of the banks of the tests
+BANK_SIZES = {'small': 2, 'large': 8}
+
+
+def make_bank(name, size):
+    bank_path = os.path.join(work_directory, 'banks', name)
+    os.makedirs(bank_path)
+    with open(os.path.join(bank_path, 'description.txt'), 'w') as file:
+        file.write(f'{name} bank')
+    for i in range(size):
+        Image.new('RGB', (40, 30)).save(os.path.join(bank_path, f'image{i}.jpg'))
+        with open(os.path.join(bank_path, f'image{i}.txt'), 'w') as file:
+            file.write(f'{name} {i}\nspecies\nlocation\nForewing with dark brown spots and a pale band.\n')
+
+
+shutil.copytree(os.path.join(repository, 'termlist'), os.path.join(work_directory, 'termlist'))
+shutil.copytree(os.path.join(repository, 'avatars'), os.path.join(work_directory, 'avatars'))
+for bank_name, bank_size in BANK_SIZES.items():
+    make_bank(bank_name, bank_size)
+os.chdir(work_directory)
+os.environ['APP_CONFIG'] = 'testing'
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(work_directory, 'butterfly.db')
+sys.path.insert(0, repository)
+
+from website.app import app as butterfly_app  # noqa: E402
+from website.database.access import db  # noqa: E402
+from website.database.models import ImageBank  # noqa: E402
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(work_directory, ignore_errors=True)
+
+
+@pytest.fixture(scope='session')
+def app():
+    return butterfly_app
+
+
+@pytest.fixture
+def client(app):
+    """
+    A client logged in as the super user, admin of every bank.
+    """
+    client = app.test_client()
+    response = client.post('/login', json={'username': 'admin', 'password': 'admin'})
+    assert response.status_code == HTTPStatus.OK
+    return client
+
+
+@pytest.fixture(scope='session')
+def bank_ids(app):
+    """
+    The ids of the banks of `BANK_SIZES`, by name.
+    """
+    with app.app_context():
+        return dict(db.session.query(ImageBank.bankname, ImageBank.id))
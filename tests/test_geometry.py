@@ -0,0 +1,73 @@
+"""
+Computations of `PolygonalRegion` over its coordinate array, with NumPy and
+with the `array` fallback.
+"""
+import math
+
+import pytest
+
+from website.images import geometry
+from website.images.geometry import PolygonalRegion
+
+
+@pytest.fixture(params=['numpy', 'array'])
+def backend(request, monkeypatch):
+    if request.param == 'array':
+        monkeypatch.setattr(geometry, 'numpy', None)
+    elif geometry.numpy is None:
+        pytest.skip('NumPy is not installed')
+    return request.param
+
+
+def circle(vertices, radius=300, center=500):
+    coords = []
+    for i in range(vertices):
+        angle = 2 * math.pi * i / vertices
+        coords += [round(center + radius * math.cos(angle)), round(center + radius * math.sin(angle))]
+    return coords
+
+
+def line_distance(px, py, ax, ay, bx, by):
+    dx, dy = bx - ax, by - ay
+    return abs(dy * (px - ax) - dx * (py - ay)) / math.hypot(dx, dy)
+
+
+def test_simplify_removes_collinear_vertices(backend):
+    region = PolygonalRegion.from_coords([0, 0, 5, 0, 10, 0, 10, 5, 10, 10, 0, 10])
+    assert region.simplify(0.5).coords() == [0, 0, 10, 0, 10, 10, 0, 10]
+
+
+def test_simplify_keeps_vertices_beyond_tolerance(backend):
+    coords = [0, 0, 5, 3, 10, 0, 10, 10, 0, 10]
+    region = PolygonalRegion.from_coords(coords)
+    assert region.simplify(2).coords() == coords
+    assert region.simplify(4).coords() == [0, 0, 10, 0, 10, 10, 0, 10]
+
+
+def test_simplify_stays_within_tolerance(backend):
+    coords = circle(2000)
+    simplified = PolygonalRegion.from_coords(coords).simplify(2).coords()
+    kept = list(zip(simplified[0::2], simplified[1::2]))
+    assert 3 <= len(kept) < 100
+    vertices = list(zip(coords[0::2], coords[1::2]))
+    # the kept vertices are original ones, in order...
+    positions = [vertices.index(vertex) for vertex in kept]
+    assert positions == sorted(positions)
+    # ...and each removed vertex is close to the edge replacing it
+    for (start, a), (end, b) in zip(zip(positions, kept), zip(positions[1:] + [len(vertices)], kept[1:] + kept[:1])):
+        for vertex in vertices[start + 1:end]:
+            assert line_distance(*vertex, *a, *b) <= 2
+
+
+def test_simplify_keeps_small_polygons(backend):
+    coords = [0, 0, 1, 0, 1, 1, 0, 1]
+    assert PolygonalRegion.from_coords(coords).simplify(5).coords() == coords
+
+
+def test_simplify_backends_agree(monkeypatch):
+    if geometry.numpy is None:
+        pytest.skip('NumPy is not installed')
+    coords = circle(1000) + [800, 800, 790, 805]
+    expected = PolygonalRegion.from_coords(coords).simplify(1.5).coords()
+    monkeypatch.setattr(geometry, 'numpy', None)
+    assert PolygonalRegion.from_coords(coords).simplify(1.5).coords() == expected
@@ -0,0 +1,67 @@
+"""
+Access to the status of the background jobs.
+"""
+from http import HTTPStatus
+
+import pytest
+
+from website.database.models import User
+from website.database.access import db
+from website.jobs import JOB_ERROR_MESSAGE, create_job, run_job
+
+
+def register(app, username):
+    client = app.test_client()
+    response = client.post('/register', json={'username': username, 'email': f'{username}@example.com',
+                                              'password': username})
+    assert response.status_code == HTTPStatus.OK
+    return client
+
+
+@pytest.fixture(scope='module')
+def users(app):
+    clients = {name: register(app, name) for name in ('job-owner', 'job-other')}
+    with app.app_context():
+        owner_id = db.session.query(User.id).filter(User.username == 'job-owner').scalar()
+        job_ids = {'owned': create_job('upload', owner_id), 'app': create_job('discovery')}
+    return clients, job_ids
+
+
+def test_owner_follows_its_job(users):
+    clients, job_ids = users
+    response = clients['job-owner'].get(f'/api/jobs/{job_ids["owned"]}')
+    assert response.status_code == HTTPStatus.OK
+    assert response.json['kind'] == 'upload'
+
+
+@pytest.mark.parametrize('user, job', [('job-other', 'owned'), ('job-owner', 'app'), ('job-other', 'app')])
+def test_others_cannot_follow_a_job(users, user, job):
+    clients, job_ids = users
+    assert clients[user].get(f'/api/jobs/{job_ids[job]}').status_code == HTTPStatus.UNAUTHORIZED
+
+
+@pytest.mark.parametrize('job', ['owned', 'app'])
+def test_super_user_follows_all_jobs(client, users, job):
+    _, job_ids = users
+    assert client.get(f'/api/jobs/{job_ids[job]}').status_code == HTTPStatus.OK
+
+
+def test_discovery_status_requires_login(app, client):
+    assert app.test_client().get('/api/discovery-status').status_code == HTTPStatus.UNAUTHORIZED
+    assert client.get('/api/discovery-status').status_code == HTTPStatus.OK
+
+
+def test_failed_job_hides_the_error(app, users):
+    clients, _ = users
+    owner = clients['job-owner']
+
+    def target(progress):
+        raise OSError('/srv/butterfly/banks/secret: permission denied')
+
+    with app.app_context():
+        owner_id = db.session.query(User.id).filter(User.username == 'job-owner').scalar()
+        job_id = create_job('upload', owner_id)
+        run_job(job_id, target)
+    response = owner.get(f'/api/jobs/{job_id}')
+    assert response.json['status'] == 'failed'
+    assert response.json['message'] == JOB_ERROR_MESSAGE
@@ -0,0 +1,124 @@
+"""
+Number of SQL queries of the hot endpoints, reported by the `X-Query-Count`
+header (`COUNT_QUERIES`): they must not grow with the number of banks,
+images or annotations.
+"""
+from http import HTTPStatus
+
+from conftest import BANK_SIZES
+
+# maximal number of queries of each endpoint, once the user, its
+# permissions and the keywords of the bank are cached
+MAX_QUERIES = {
+    'bank-list': 1,
+    'image-list': 2,
+    'image-data': 3,
+    'unannotated-image-data': 3,
+    'session': 3,
+    'annotate': 5,
+}
+# number of images of the sessions
+SESSION_SIZE = 4
+# points of an annotation
+POINTS = [{'x': 1, 'y': 1}, {'x': 20, 'y': 2}, {'x': 10, 'y': 25}]
+
+
+def query_count(response):
+    assert response.status_code == HTTPStatus.OK, response.data
+    return int(response.headers['X-Query-Count'])
+
+
+def first_image_ids(client, bank_id, count):
+    images = client.get(f'/api/bank/{bank_id}').json['images']
+    return [image['id'] for image in images[:count]]
+
+
+def annotate(client, image_id, count):
+    """
+    Replaces the annotations of the given image with `count` new ones, and
+    returns the response.
+    """
+    return client.post('/api/image/annotate', json={
+        'imageId': str(image_id),
+        'annotations': [{'id': -1, 'points': POINTS, 'tag': {'start': 0, 'end': 4}} for _ in range(count)],
+    })
+
+
+def test_bank_list(client):
+    client.get('/api/bank-list')
+    response = client.get('/api/bank-list')
+    assert len(response.json) == len(BANK_SIZES)
+    assert query_count(response) <= MAX_QUERIES['bank-list']
+
+
+def test_image_list(client, bank_ids):
+    counts = []
+    for name in BANK_SIZES:
+        client.get(f'/api/bank/{bank_ids[name]}')
+        response = client.get(f'/api/bank/{bank_ids[name]}')
+        assert len(response.json['images']) == BANK_SIZES[name]
+        counts.append(query_count(response))
+    assert len(set(counts)) == 1
+    assert counts[0] <= MAX_QUERIES['image-list']
+
+
+def test_image_list_of_annotated_images(client, bank_ids):
+    bank_id = bank_ids['large']
+    client.get(f'/api/bank/{bank_id}')
+    before = query_count(client.get(f'/api/bank/{bank_id}'))
+    for image_id in first_image_ids(client, bank_id, 3):
+        query_count(annotate(client, image_id, 2))
+    assert query_count(client.get(f'/api/bank/{bank_id}')) == before
+
+
+def test_image_data(client, bank_ids):
+    image_id, other_image_id = first_image_ids(client, bank_ids['large'], 2)
+    query_count(annotate(client, image_id, 1))
+    query_count(annotate(client, other_image_id, 30))
+    client.get(f'/api/image/{image_id}')
+    count = query_count(client.get(f'/api/image/{image_id}'))
+    assert query_count(client.get(f'/api/image/{other_image_id}')) == count
+    assert count <= MAX_QUERIES['image-data']
+
+
+def unannotated_image_ids(client, bank_id, count):
+    """
+    Returns the ids of the last `count` images of a bank, which the other
+    tests do not annotate.
+    """
+    image_ids = first_image_ids(client, bank_id, BANK_SIZES['large'])[-count:]
+    for image_id in image_ids:
+        assert client.get(f'/api/image/{image_id}').json['annotations'] == []
+    return image_ids
+
+
+def test_unannotated_image_data(client, bank_ids):
+    image_id, other_image_id = unannotated_image_ids(client, bank_ids['large'], 2)
+    client.get(f'/api/image/{image_id}')
+    count = query_count(client.get(f'/api/image/{image_id}'))
+    assert query_count(client.get(f'/api/image/{other_image_id}')) == count
+    assert count <= MAX_QUERIES['unannotated-image-data']
+
+
+def test_session_of_unannotated_images(client, bank_ids):
+    image_ids = unannotated_image_ids(client, bank_ids['large'], SESSION_SIZE)
+    counts = []
+    for size in (1, SESSION_SIZE):
+        client.get(f'/api/image/{image_ids[0]}/session', query_string={'count': size})
+        response = client.get(f'/api/image/{image_ids[0]}/session', query_string={'count': size})
+        assert [image['id'] for image in response.json['images']] == image_ids[:size]
+        counts.append(query_count(response))
+    # the same queries, whatever the number of images
+    assert counts[0] == counts[1]
+    assert counts[0] <= MAX_QUERIES['session']
+
+
+def test_annotate(client, bank_ids):
+    image_id, other_image_id = first_image_ids(client, bank_ids['small'], 2)
+    query_count(annotate(client, image_id, 1))
+    count = query_count(annotate(client, image_id, 1))
+    query_count(annotate(client, other_image_id, 1))
+    # one INSERT per new annotation (SQLite returns the id of a single
+    # inserted row), in the same transaction: the other queries are the same
+    assert query_count(annotate(client, other_image_id, 30)) == count + 29
+    assert count <= MAX_QUERIES['annotate']
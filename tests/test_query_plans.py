@@ -0,0 +1,10 @@
+"""
+Plans of the hot queries on the test database: none may scan a table (see
+`website.database.plans`).
+"""
+from website.database.plans import check_query_plans
+
+
+def test_hot_queries_use_indexes(app):
+    with app.app_context():
+        assert check_query_plans() == []
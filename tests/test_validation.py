@@ -0,0 +1,56 @@
+"""
+Rejection of the ill-formed query parameters.
+"""
+from http import HTTPStatus
+
+import pytest
+
+
+@pytest.mark.parametrize('limit', ['0', '-1', '-10', 'a', ''])
+def test_image_list_rejects_invalid_limits(client, bank_ids, limit):
+    response = client.get(f'/api/bank/{bank_ids["large"]}', query_string={'limit': limit})
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+def test_image_list_pages(client, bank_ids):
+    response = client.get(f'/api/bank/{bank_ids["large"]}', query_string={'limit': '1'})
+    assert response.status_code == HTTPStatus.OK
+    assert len(response.json['images']) == 1
+    assert response.json['nextCursor'] == response.json['images'][0]['id']
+
+
+@pytest.mark.parametrize('value', ['nan', 'inf', '-inf', 'x'])
+def test_regions_at_rejects_non_finite_coordinates(client, bank_ids, value):
+    image_id = client.get(f'/api/bank/{bank_ids["small"]}').json['images'][0]['id']
+    response = client.get(f'/api/image/{image_id}/regions-at', query_string={'x': value, 'y': '1'})
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+@pytest.mark.parametrize('limit', ['0', '-1'])
+def test_regions_in_box_rejects_invalid_limits(client, bank_ids, limit):
+    response = client.get(f'/api/bank/{bank_ids["small"]}/regions-in-box',
+                          query_string={'x0': '0', 'y0': '0', 'x1': '10', 'y1': '10', 'limit': limit})
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+@pytest.mark.parametrize('value', [float('nan'), float('inf'), float('-inf')])
+def test_annotate_rejects_non_finite_coordinates(client, bank_ids, value):
+    image_id = client.get(f'/api/bank/{bank_ids["small"]}').json['images'][0]['id']
+    response = client.post('/api/image/annotate', json={
+        'imageId': str(image_id),
+        'annotations': [{'id': -1, 'points': [{'x': 1, 'y': 1}, {'x': value, 'y': 2}, {'x': 10, 'y': 25}],
+                         'tag': {'start': 0, 'end': 4}}],
+    })
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert response.json['message'] == 'ill-formed polygonal region'
+
+
+def test_thumbnail(client):
+    response = client.get('/api/thumbnail/256/small/image0.jpg')
+    assert response.status_code == HTTPStatus.OK
+    assert response.mimetype == 'image/jpeg'
+
+
+@pytest.mark.parametrize('path', ['small/image0.txt', 'small/description.txt', 'small/missing.jpg'])
+def test_thumbnail_of_other_files(client, path):
+    assert client.get(f'/api/thumbnail/256/{path}').status_code == HTTPStatus.NOT_FOUND
@@ -1,16 +1,17 @@
 import os
 
-from flask import Blueprint, current_app, request, jsonify, send_file, session
+from flask import Blueprint, Response, current_app, request, jsonify, safe_join, session
 from flask_login import current_user, login_user, logout_user, login_required
-from flask_bcrypt import Bcrypt
 from http import HTTPStatus
 
 from ..database.models import User
 from ..database.access import db
+from ..database.users import get_user_by_name, invalidate_user
+from ..images.avatars import DEFAULT_AVATAR_KEY, avatar_key, get_avatar_cache, verify_picture
+from ..passwords import PasswordPoolBusy, check_password, hash_password, needs_rehash
 import os
 
 account_api = Blueprint('account_api', __name__)
-bcrypt = Bcrypt(current_app)
 avatars_dir = os.getcwd() + os.sep + 'avatars'
 if not os.path.exists(avatars_dir):
     os.mkdir(avatars_dir)
@@ -24,6 +25,13 @@ def get_default_data(user):
     return jsonify({'username': user.username, 'email': user.email})
 
 
+@account_api.errorhandler(PasswordPoolBusy)
+def password_pool_busy(e):
+    response = jsonify({'message': 'too many logins at once, please retry'})
+    response.headers['Retry-After'] = '1'
+    return response, HTTPStatus.SERVICE_UNAVAILABLE
+
+
 @account_api.route('/register', methods=['POST'])
 def register():
     user_info = request.get_json()
@@ -38,7 +46,7 @@ def register():
     if duplicate_email:
         return jsonify({'message': 'Email already exists'}), HTTPStatus.UNAUTHORIZED
     else:
-        password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        password_hash = hash_password(password)
         user = User(username=username, email=email, password_hash=password_hash)
         db.session.add(user)
         db.session.commit()
@@ -57,7 +65,11 @@ def login():
 
     user = db.session.query(User).filter(User.username == username).first()
     if user is not None:
-        if bcrypt.check_password_hash(user.password_hash, password):
+        if check_password(user.password_hash, password):
+            if needs_rehash(user.password_hash):
+                # the cost factor changed since the password was set
+                user.password_hash = hash_password(password)
+                db.session.commit()
             do_login(user)
             return get_default_data(current_user)
         else:
@@ -91,29 +103,57 @@ def get_base_data():
 def upload_profile_picture():
     if not request.files:
         return jsonify({'message': 'no file provided'})
+    if request.content_length is not None \
+            and request.content_length > current_app.config['AVATAR_MAX_UPLOAD_SIZE']:
+        return jsonify({'message': 'picture too large'}), HTTPStatus.REQUEST_ENTITY_TOO_LARGE
     picture = request.files['file']
-    location = os.path.join(avatars_dir, current_user.username + '.jpg')
-    if os.path.isfile(location):
-        os.remove(location)
-    picture.save(location)
-    current_user.has_profile_picture = True
+    if not verify_picture(picture.stream):
+        return jsonify({'message': 'not a valid picture'}), HTTPStatus.BAD_REQUEST
+    location = safe_join(avatars_dir, current_user.username + '.jpg')
+    # replaced at once, so that its variants are never generated from a partial file
+    picture.save(location + '.upload')
+    os.replace(location + '.upload', location)
+    db.session.query(User).filter(User.id == current_user.id).update({User.has_profile_picture: True})
     db.session.commit()
+    invalidate_user(current_user.id)
+    get_avatar_cache(current_app.config).pregenerate(avatar_key(current_user.username), location)
     return jsonify({'message': 'OK'})
 
 
 @account_api.route('/api/profile-picture/<username>', methods=['GET'])
 @login_required
 def get_profile_picture(username):
+    """
+    Serves the avatar of a user, resized to the smallest of the
+    `AVATAR_SIZES` at least as large as the optional `size` query
+    parameter (default: the largest).
+    """
     if not username:
         return jsonify({'message': 'no username provided'}), HTTPStatus.BAD_REQUEST
-    user = db.session.query(User).filter(User.username == username).first()
+    sizes = current_app.config['AVATAR_SIZES']
+    requested = request.args.get('size', '')
+    size = max(sizes)
+    if requested.isnumeric():
+        size = min([s for s in sizes if s >= int(requested)], default=size)
+    user = get_user_by_name(username)
     if not user:
         return jsonify({'message': 'no such user'}), HTTPStatus.NOT_FOUND
+    cache = get_avatar_cache(current_app.config)
+    etag, data = None, None
     if user.has_profile_picture:
-        location = os.path.join(avatars_dir, user.username + '.jpg')
-        return send_file(location, mimetype='image/jpeg')
-    # send default picture
-    return send_file(os.path.join(avatars_dir, 'nopic.jpg'), mimetype='image/jpeg')
+        user_location = safe_join(avatars_dir, user.username + '.jpg')
+        try:
+            etag, data = cache.get(avatar_key(user.username), user_location, size)
+        except OSError:
+            # missing or undecodable picture (PIL's `UnidentifiedImageError` is an `OSError`)
+            pass
+    if data is None:
+        etag, data = cache.get(DEFAULT_AVATAR_KEY, os.path.join(avatars_dir, 'nopic.jpg'), size)
+    response = Response(data, mimetype='image/jpeg')
+    response.set_etag(etag)
+    # avatars can change under the same URL: revalidated on each use
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 
 @account_api.route('/api/user-info/<username>', methods=['GET'])
@@ -121,7 +161,7 @@ def get_profile_picture(username):
 def get_user_info(username):
     if not username:
         return jsonify({'message': 'no username provided'}), HTTPStatus.BAD_REQUEST
-    user = db.session.query(User).filter(User.username == username).first()
+    user = get_user_by_name(username)
     if not user:
         return jsonify({'message': 'no such user'}), HTTPStatus.NOT_FOUND
     return jsonify({
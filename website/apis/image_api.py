@@ -1,32 +1,40 @@
 """
 The part of the API that allows access to the images of a database.
 """
+from collections import defaultdict
+import datetime
+import math
 from pathlib import Path
 from flask.json import jsonify
-from flask import Blueprint, request, escape, send_file
+from flask import Blueprint, Response, current_app, json, request, escape, safe_join, send_file, \
+    send_from_directory, stream_with_context, url_for
 from flask_login import login_required, current_user
-from sqlalchemy import and_, desc
+from sqlalchemy import and_, desc, func
+from sqlalchemy.exc import IntegrityError
 from http import HTTPStatus
 import os
 import shutil
-import zipfile
+from urllib.parse import quote
 
-from website.images.banks import delete_bank
+from website.images.banks import delete_bank, delete_bank_by_chunks, mark_bank_deleting
 from ..database.access import db
-from ..database.models import User, BankAccess, ImageToAnnotate, ImageAnnotation, ImageBank, UserSelectedKeyword
+from ..database.queries import bank_annotations_in_box, bank_image_listing, bank_name, image_annotations_at, \
+    image_window, image_with_annotations, neighbour_image_ids
+from ..database.models import User, BankAccess, ImageToAnnotate, ImageAnnotation, ImageBank, Job, UserSelectedKeyword
+from ..database.permissions import bank_levels, invalidate_user_permissions
+from ..images.codec import coords_to_text, region_columns, region_coords, region_text
 from ..images.geometry import PolygonalRegion
-from ..images.discovery import default_bank_directory, discover_bank
-from ..textproc.proc import get_keywords
+from ..images.thumbnails import get_thumbnail_cache
+from ..images.discovery import default_bank_directory
+from ..images.upload import ingest_bank, save_archive
+from ..textproc.proc import get_keywords, suggestion_engine, user_keyword_cache
+from ..textproc.precompute import precomputed_spans, precomputed_spans_of
+from ..jobs import start_job
 
 basedir = os.path.abspath(os.path.dirname(__name__))
 image_api = Blueprint('image_api', __name__)
 
 
-ADJ_LIST_PATH = os.path.join(os.getcwd(), 'termlist', 'adjlist.txt')
-COLOR_LIST_PATH = os.path.join(os.getcwd(), 'termlist', 'colorlist.txt')
-PATTERN_LIST_PATH = os.path.join(os.getcwd(), 'termlist', 'patternlist.txt')
-
-
 bank_access_levels = {
     'super-admin': 100,  # reserved: one such account per app instance
     'admin': 90,
@@ -36,58 +44,110 @@ bank_access_levels = {
 }
 
 
-def load_word_list(p):
-    """
-    Loads a list of provided words.
-    """
-    ls = []
-    if os.path.isfile(p):
-        with open(p, 'r') as file:
-            lines = file.readlines()
-            for line in lines:
-                ls.append(line.strip().lower())
-    return ls
+# number of images fetched at once when exporting a bank
+EXPORT_WINDOW = 500
+# maximal number of images of a page of a bank's listing
+MAX_PAGE_SIZE = 1000
 
 
-# lists of words for the automatic suggestions
-adj_list = load_word_list(ADJ_LIST_PATH) + load_word_list(COLOR_LIST_PATH)
-pattern_list = load_word_list(PATTERN_LIST_PATH)
+def annotation_to_json(annotation):
+    return {
+        'id': annotation.id,
+        'description': {
+            'start': annotation.text_start,
+            'end': annotation.text_end,
+        },
+        'regionInfo': region_text(annotation.region_info, annotation.region_data),
+    }
 
 
 def gen_annotation_array(image):
-    return [
-        {
-            'id': annotation.id,
-            'description': {
-                'start': annotation.text_start,
-                'end': annotation.text_end,
-            },
-            'regionInfo': annotation.region_info,
-        } for annotation in image.annotations
-    ]
+    return [annotation_to_json(annotation) for annotation in image.annotations]
+
+
+def iter_exported_images(bank_id):
+    """
+    Yields the exported form of the images of a bank, with their
+    annotations. Images are fetched `EXPORT_WINDOW` at a time (by
+    increasing id), with one query for the annotations of each window.
+    """
+    last_id = 0
+    while True:
+        images = db.session.query(ImageToAnnotate.id, ImageToAnnotate.description, ImageToAnnotate.width,
+                                  ImageToAnnotate.height, ImageToAnnotate.file_url) \
+            .filter(and_(ImageToAnnotate.image_bank_id == bank_id, ImageToAnnotate.id > last_id)) \
+            .order_by(ImageToAnnotate.id) \
+            .limit(EXPORT_WINDOW) \
+            .all()
+        if not images:
+            return
+        annotations = defaultdict(list)
+        for annotation in db.session.query(ImageAnnotation.id, ImageAnnotation.image_id, ImageAnnotation.text_start,
+                                           ImageAnnotation.text_end, ImageAnnotation.region_info,
+                                           ImageAnnotation.region_data) \
+                .filter(ImageAnnotation.image_id.in_([image.id for image in images])) \
+                .order_by(ImageAnnotation.id):
+            annotations[annotation.image_id].append(annotation_to_json(annotation))
+        for image in images:
+            yield {
+                'id': image.id,
+                'description': image.description,
+                'width': image.width,
+                'height': image.height,
+                'relativePath': image.file_url,
+                'annotations': annotations[image.id],
+            }
+        last_id = images[-1].id
 
 
-def save_user_keywords_selection(description, image_bank_id, start, end):
+def save_user_keywords_selection(description, image_bank_id, selections):
+    """
+    Adds user's provided selections (`(start, end)` pairs) to the database
+    for future suggestions, without committing. Returns the rows of the
+    keywords that were not known yet, to write them through to
+    `user_keyword_cache` once committed.
     """
-    Adds user's provided selection to the database for future suggestions.
+    # deduplicated, in the order of the selections
+    words = list(dict.fromkeys(description[start:end].lower() for start, end in selections))
+    if not words:
+        return []
+    known = {keyword for keyword, in db.session.query(UserSelectedKeyword.keyword)
+             .filter(and_(UserSelectedKeyword.image_bank_id == image_bank_id,
+                          UserSelectedKeyword.keyword.in_(words)))}
+    new_keywords = [UserSelectedKeyword(image_bank_id=image_bank_id, keyword=word)
+                    for word in words if word not in known]
+    db.session.add_all(new_keywords)
+    return new_keywords
+
+
+def update_image_summary(image_id, editor_id):
     """
-    words = description[start:end].lower()
-    keyword = db.session.query(UserSelectedKeyword)\
-        .filter(and_(UserSelectedKeyword.image_bank_id == image_bank_id, UserSelectedKeyword.keyword == words))\
-        .first()
-    if not keyword:
-        user_selected_keyword = UserSelectedKeyword(image_bank_id=image_bank_id, keyword=words)
-        db.session.add(user_selected_keyword)
-        db.session.commit()
+    Updates the annotation summary of an image after `editor_id` changed
+    its annotations (not committed).
+    """
+    db.session.query(ImageToAnnotate).filter(ImageToAnnotate.id == image_id).update({
+        ImageToAnnotate.annotation_count: db.session.query(func.count(ImageAnnotation.id))
+        .filter(ImageAnnotation.image_id == image_id)
+        .scalar_subquery(),
+        ImageToAnnotate.last_editor_id: editor_id,
+        ImageToAnnotate.last_modified: datetime.datetime.utcnow(),
+    }, synchronize_session=False)
 
 
 def can_access_bank(bank, user, access_level='viewer'):
     """
     Returns `True` iff the given user can access the provided bank.
     """
-    level = bank_access_levels[access_level]
-    return bank.id in [access.bank_id for access in user.accesses 
-        if access.permission_level >= level]
+    return can_access_bank_id(bank.id, user, access_level)
+
+
+def can_access_bank_id(bank_id, user, access_level='viewer'):
+    """
+    Same as `can_access_bank`, from the id of the bank (eg the
+    `image_bank_id` of an image, without loading its bank).
+    """
+    level = bank_levels(user.id).get(bank_id)
+    return level is not None and level >= bank_access_levels[access_level]
 
 
 def ensure_image_exists(raw_id):
@@ -103,12 +163,10 @@ def ensure_image_exists(raw_id):
 
 def get_bank_access_level(user, bank_id):
     """
-    Returns the BankAccess object for the given user and the given
-    bank.
+    Returns the permission level of the given user on the given bank, or
+    `None` if the user cannot access it.
     """
-    bank_access = [access for access in user.accesses 
-        if access.bank_id == bank_id]
-    return bank_access[0] if bank_access else None
+    return bank_levels(user.id).get(bank_id)
 
 
 @image_api.route('/api/bank-list', methods=['GET'])
@@ -118,11 +176,14 @@ def list_banks():
     Returns the list of banks available to the current user.
     """
     banks = []
-    for access in current_user.accesses:
+    for bank in db.session.query(ImageBank.id, ImageBank.bankname, ImageBank.description) \
+            .join(BankAccess, BankAccess.bank_id == ImageBank.id) \
+            .filter(BankAccess.user_id == current_user.id) \
+            .order_by(BankAccess.id):
         banks.append({
-            'id': access.bank.id,
-            'name': access.bank.bankname,
-            'description': access.bank.description
+            'id': bank.id,
+            'name': bank.bankname,
+            'description': bank.description
         })
     return jsonify(banks)
 
@@ -146,32 +207,34 @@ def manage_access_bank():
     bank = db.session.query(ImageBank).filter(ImageBank.id == int(data['id'])).first()
     if bank is None:
         return jsonify({'message': 'no such bank'}), HTTPStatus.NOT_FOUND
-    user_access = get_bank_access_level(current_user, bank.id)
-    if not user_access:
+    user_level = get_bank_access_level(current_user, bank.id)
+    if user_level is None:
         return jsonify({'message': 'you do not have access to this bank'}), HTTPStatus.UNAUTHORIZED
     # now that bank & target exist and are accessible,
     # check for permission levels
-    if user_access.permission_level < bank_access_levels['moderator']:
+    if user_level < bank_access_levels['moderator']:
         return jsonify({'message': 'insufficient permissions'}), HTTPStatus.UNAUTHORIZED
-    if level >= bank_access_levels['moderator'] and user_access.permission_level < user_access['admin']:
+    if level >= bank_access_levels['moderator'] and user_level < bank_access_levels['admin']:
         # only admins can assign other admins and moderators
         return jsonify({'message': 'insufficient permissions'}), HTTPStatus.UNAUTHORIZED
-    target_access = get_bank_access_level(target_user, bank.id)
-    if not target_access or target_access.permission_level < user_access.permission_level:
+    target_level = get_bank_access_level(target_user, bank.id)
+    if target_level is None or target_level < user_level:
         # the originating user is able to edit access for target
-        target_query = db.session.query(BankAccess).filter(BankAccess.user_id == target_user.id)
+        target_query = db.session.query(BankAccess) \
+            .filter(and_(BankAccess.user_id == target_user.id, BankAccess.bank_id == bank.id))
         if level == -1:
-            if target_access:
+            if target_level is not None:
                 target_query.delete()
                 db.session.commit()
             # else: user is trying to remove a user that has already no access (ignore)
         else:
-            if target_access:
+            if target_level is not None:
                 target_query.update({ BankAccess.permission_level: level })
                 db.session.commit()
             else:
                 db.session.add(BankAccess(target_user.id, bank.id, level))
                 db.session.commit()
+        invalidate_user_permissions(target_user.id)
         return jsonify({'message': 'success'})
     # user is trying to update permissions of someone of the same rank
     return jsonify({'message': 'insufficient permissions'}), HTTPStatus.UNAUTHORIZED
@@ -202,24 +265,49 @@ def list_bank_accesses(bank_id):
 def list_images(bank_id):
     """
     Returns the list of the images of a given endpoint.
+
+    Optional query parameters: `limit` (page size) and `after` (the
+    `nextCursor` of the previous page) to list the images by pages,
+    `annotated` (`true` or `false`) and `editor` (a username) to filter
+    them.
     """
     if not bank_id.isnumeric():
         return jsonify({'message': 'ill-formed request'}), HTTPStatus.BAD_REQUEST
-    banks_dict = {access.bank_id: access.bank for access in current_user.accesses}
     bank_id = int(bank_id)
-    if bank_id not in banks_dict:
+    if bank_id not in bank_levels(current_user.id):
         return jsonify({'message': 'you do not have access to this bank'}), HTTPStatus.UNAUTHORIZED
+    limit = request.args.get('limit')
+    after = request.args.get('after')
+    annotated = request.args.get('annotated')
+    if (limit is not None and (not limit.isnumeric() or int(limit) < 1)) \
+            or (after is not None and not after.isnumeric()) or annotated not in (None, 'true', 'false'):
+        return jsonify({'message': 'ill-formed request'}), HTTPStatus.BAD_REQUEST
+    if limit is not None:
+        limit = min(int(limit), MAX_PAGE_SIZE)
+    images = bank_image_listing(bank_id,
+                                after=int(after) if after is not None else None,
+                                # one more, to know whether there is a next page
+                                limit=limit + 1 if limit is not None else None,
+                                annotated=annotated == 'true' if annotated is not None else None,
+                                editor=request.args.get('editor'))
+    next_cursor = None
+    if limit is not None and len(images) > limit:
+        images = images[:limit]
+        next_cursor = images[-1].id if images else None
+    thumbnail_size = current_app.config['THUMBNAIL_SIZES'][0]
     return {
-        'bankName': banks_dict[bank_id].bankname,
+        'bankName': bank_name(bank_id),
+        'nextCursor': next_cursor,
         'images': [
             {
                 'id': image.id,
                 'url': 'image-serve/' + image.file_url,
+                'thumbnailUrl': f'thumbnail/{thumbnail_size}/{image.file_url}',
                 'fullDescription': image.description,
                 'lastEditor': {
-                    'username': image.annotations[0].author.username,
-                } if image.annotations else '',
-            } for image in banks_dict[bank_id].images
+                    'username': image.last_editor,
+                } if image.annotation_count else '',
+            } for image in images
         ]}
 
 
@@ -231,18 +319,42 @@ def insert_annotations():
     Returns the ids in the order of insertion.
     """
     req = request.get_json()
+    try:
+        return save_annotations(req)
+    except IntegrityError:
+        # a concurrent save stored one of the new keywords of the bank first,
+        # saving again finds it known
+        db.session.rollback()
+        return save_annotations(req)
+
+
+def save_annotations(req):
+    """
+    Saves the annotations of an `insert_annotations` request, in a single
+    transaction.
+    """
     image = ensure_image_exists(req['imageId'])
     if image is None:
         return jsonify({'message': 'there exists no image with such an id'}), HTTPStatus.NOT_FOUND
     if 'annotations' not in req:
         return jsonify({'result': 'success'})
-    if not can_access_bank(image.image_bank, current_user, access_level='editor'):
+    if not can_access_bank_id(image.image_bank_id, current_user, access_level='editor'):
         return jsonify({'message': 'not authorized to annotate this bank'}), HTTPStatus.UNAUTHORIZED
+    # the current state of the image's annotations, in one query
+    existing = {
+        annotation.id: annotation for annotation in
+        db.session.query(ImageAnnotation.id, ImageAnnotation.text_start, ImageAnnotation.text_end,
+                         ImageAnnotation.region_info, ImageAnnotation.region_data)
+        .filter(ImageAnnotation.image_id == image.id)
+    }
     # first pass: verify all data
-    for annotation in req['annotations']:
+    storage = current_app.config['REGION_STORAGE']
+    regions = {}
+    bounds = {}
+    for i, annotation in enumerate(req['annotations']):
         if annotation['id'] != -1:
             # trying to update existing annotation
-            if int(annotation['id']) not in [annot.id for annot in image.annotations]:
+            if int(annotation['id']) not in existing:
                 return jsonify({'message': 'trying to update an annotation that does not exist'}), \
                        HTTPStatus.BAD_REQUEST
         if 'rem' in annotation:
@@ -251,83 +363,105 @@ def insert_annotations():
             region = PolygonalRegion.deserialize_from_json(annotation['points'])
         except Exception:
             return jsonify({'message': 'ill-formed polygonal region'}), HTTPStatus.BAD_REQUEST
-        if max(map(lambda p: p.x, region.points)) > image.width or \
-                min(map(lambda p: p.x, region.points)) < 0 or \
-                max(map(lambda p: p.y, region.points)) > image.height or \
-                min(map(lambda p: p.y, region.points)) < 0:
+        if not region.within(image.width, image.height):
             return jsonify({'message': 'there exists a point out of bounds'}), HTTPStatus.BAD_REQUEST
-
-    # second pass: update database
+        regions[i] = region.coords()
+        bounds[i] = [int(value) for value in region.bounds()]
+
+    # second pass: update database, in a single transaction
+    removed = {int(annotation['id']) for annotation in req['annotations'] if 'rem' in annotation}
+    if removed:
+        db.session.query(ImageAnnotation).filter(ImageAnnotation.id.in_(removed)) \
+            .delete(synchronize_session=False)
+    # ids in the order of the request; new annotations get theirs on flush
     ids = []
-    for annotation in req['annotations']:
+    added = []
+    updates = []
+    for i, annotation in enumerate(req['annotations']):
         if 'rem' in annotation:
-            db.session.query(ImageAnnotation).filter(ImageAnnotation.id == annotation['id']).delete()
-            db.session.commit()
-        else:
-            region = PolygonalRegion.deserialize_from_json(annotation['points'])
-            start = annotation['tag']['start']
-            end = annotation['tag']['end']
-            if annotation['id'] == -1:
-                # new region
-                a = ImageAnnotation(image.id, start, end, region.sql_serialize_region(), current_user.get_id())
-                db.session.add(a)
-                # commit now to get proper ID
-                db.session.commit()
-                ids.append(a.id)
-
-                # save annotations to user_keyword_selection file
-                save_user_keywords_selection(image.description, image.image_bank_id, start, end)
-            else:
-                existing_annotation = db.session.query(ImageAnnotation)\
-                    .filter(ImageAnnotation.id == annotation['id']).first()
-                if existing_annotation is None:  # Ignore: trying to update non existing
-                    continue
-                # no actual change to the data
-                if existing_annotation.text_start != start or existing_annotation.text_end != end \
-                    or PolygonalRegion.sql_serialize_region(region) == existing_annotation.region_info:
-                    ids.append(annotation['id'])
-                    continue
-                # perform update
-                db.session.query(ImageAnnotation)\
-                    .filter(ImageAnnotation.id == annotation['id'])\
-                    .update({
-                        ImageAnnotation.region_info: region.sql_serialize_region(),
-                        ImageAnnotation.text_start: start,
-                        ImageAnnotation.text_end: end,
-                        ImageAnnotation.author_id: current_user.get_id()
-                    })
-                db.session.commit()
-                ids.append(annotation['id'])
+            continue
+        start = annotation['tag']['start']
+        end = annotation['tag']['end']
+        if annotation['id'] == -1:
+            # new region
+            region_info, region_data = region_columns(regions[i], storage)
+            a = ImageAnnotation(image.id, start, end, region_info, current_user.id, region_data, bounds[i])
+            added.append(a)
+            ids.append(a)
+            continue
+        annotation_id = int(annotation['id'])
+        if annotation_id in removed:  # Ignore: trying to update a removed annotation
+            continue
+        ids.append(annotation_id)
+        current = existing[annotation_id]
+        # no actual change to the data
+        if current.text_start == start and current.text_end == end \
+                and region_text(current.region_info, current.region_data) == coords_to_text(regions[i]):
+            continue
+        region_info, region_data = region_columns(regions[i], storage)
+        updates.append({
+            'id': annotation_id,
+            'region_info': region_info,
+            'region_data': region_data,
+            'min_x': bounds[i][0],
+            'min_y': bounds[i][1],
+            'max_x': bounds[i][2],
+            'max_y': bounds[i][3],
+            'text_start': start,
+            'text_end': end,
+            'author_id': current_user.id,
+        })
+    if not removed and not added and not updates:
+        return jsonify({'result': 'success', 'ids': ids})
+    db.session.add_all(added)
+    if updates:
+        db.session.bulk_update_mappings(ImageAnnotation, updates)
+    # save annotations to user_keyword_selection file
+    new_keywords = save_user_keywords_selection(image.description, image.image_bank_id,
+                                                [(a.text_start, a.text_end) for a in added])
+    db.session.flush()
+    ids = [a.id if isinstance(a, ImageAnnotation) else a for a in ids]
+    # read before the commit expires them
+    new_keywords = [(keyword.id, keyword.keyword) for keyword in new_keywords]
+    update_image_summary(image.id, current_user.id)
+    db.session.commit()
+    for keyword_id, keyword in new_keywords:
+        user_keyword_cache.add(image.image_bank_id, keyword_id, keyword)
     return jsonify({'result': 'success', 'ids': ids})
 
 
 @image_api.route('/api/image/<image_id>', methods=['GET'])
 @login_required
 def get_image_data(image_id):
-    image = ensure_image_exists(image_id)
+    image = image_with_annotations(int(image_id)) if image_id.isnumeric() else None
     if image is None:
         return jsonify({'message': 'there is no image with such an id'}), HTTPStatus.NOT_FOUND
-    if not can_access_bank(image.image_bank, current_user):
+    if not can_access_bank_id(image.image_bank_id, current_user):
         return jsonify({'message': 'not authorized to view this bank'}), HTTPStatus.UNAUTHORIZED
-    next_image = db.session.query(ImageToAnnotate)\
-        .filter(and_(ImageToAnnotate.image_bank_id == image.image_bank_id,
-                     ImageToAnnotate.id > image.id))\
-        .order_by(ImageToAnnotate.id)\
-        .first()
-    prev_image = db.session.query(ImageToAnnotate)\
-        .filter(and_(ImageToAnnotate.image_bank_id == image.image_bank_id,
-                     ImageToAnnotate.id < image.id))\
-        .order_by(desc(ImageToAnnotate.id))\
-        .first()
-    return jsonify({
+    next_id, previous_id = neighbour_image_ids(image)
+    # the stored spans are only looked up when they are precomputed
+    spans = precomputed_spans(image.id) \
+        if not image.annotations and current_app.config['PRECOMPUTE_SUGGESTIONS'] else None
+    return jsonify(image_data_to_json(image, next_id, previous_id, spans))
+
+
+def image_data_to_json(image, next_id, previous_id, spans):
+    """
+    Returns the data of an image to annotate, as served by `get_image_data`.
+
+    :param next_id: the id of the next image of the bank, or `None`
+    :param previous_id: the id of the previous image of the bank, or `None`
+    :param spans: the precomputed suggestion spans of the image, if any
+    """
+    return {
         'id': image.id,
-        'bankId': image.image_bank.id,
+        'bankId': image.image_bank_id,
         'description': image.description,
         'width': image.width,
         'height': image.height,
         'imageUrl':  'image-serve/' + image.file_url,
-        'hasNext': next_image.id if next_image is not None else -1,
-        'hasPrevious': prev_image.id if prev_image is not None else -1,
+        'hasNext': next_id if next_id is not None else -1,
+        'hasPrevious': previous_id if previous_id is not None else -1,
         'annotations': [
             {
                 'id': annotation.id,
@@ -335,15 +469,56 @@ def get_image_data(image_id):
                     'start': annotation.text_start,
                     'end': annotation.text_end,
                 },
-                'regionInfo': annotation.region_info,
+                'regionInfo': region_text(annotation.region_info, annotation.region_data),
                 'author': annotation.author.username,
             }
             for annotation in image.annotations
         ],
         # provide suggestions if the annotations list is empty
-        'suggestions': get_keywords(adj_list, pattern_list, image.description,
-                                    image.image_bank_id) if not image.annotations else '',
-    })
+        'suggestions': get_keywords(suggestion_engine, image.description, image.image_bank_id,
+                                    spans) if not image.annotations else '',
+    }
+
+
+@image_api.route('/api/image/<int:image_id>/session', methods=['GET'])
+@login_required
+def get_annotation_session(image_id):
+    """
+    Returns the data of the given image and of the next ones of its bank, as
+    `get_image_data` does for each, so that the annotator can move through
+    them without waiting: the `images` list starts with the given image.
+    The image files are announced with `Link: rel=preload` headers.
+
+    Optional query parameters: `count` (number of images, at most
+    `ANNOTATION_SESSION_MAX_SIZE`) and `direction` (`next`, the default, or
+    `previous` to return the previous images instead).
+    """
+    count = request.args.get('count', str(current_app.config['ANNOTATION_SESSION_SIZE']))
+    direction = request.args.get('direction', 'next')
+    if not count.isnumeric() or int(count) == 0 or direction not in ('next', 'previous'):
+        return jsonify({'message': 'ill-formed request'}), HTTPStatus.BAD_REQUEST
+    count = min(int(count), current_app.config['ANNOTATION_SESSION_MAX_SIZE'])
+    backwards = direction == 'previous'
+    images, past_id = image_window(image_id, count, backwards)
+    if not images:
+        return jsonify({'message': 'there is no image with such an id'}), HTTPStatus.NOT_FOUND
+    if get_bank_access_level(current_user, images[0].image_bank_id) is None:
+        return jsonify({'message': 'not authorized to view this bank'}), HTTPStatus.UNAUTHORIZED
+    # the neighbour of the first image on the other side of the window
+    next_id, previous_id = neighbour_image_ids(images[0])
+    before_id = next_id if backwards else previous_id
+    spans = precomputed_spans_of([image.id for image in images if not image.annotations]) \
+        if current_app.config['PRECOMPUTE_SUGGESTIONS'] else {}
+    data = []
+    for i, image in enumerate(images):
+        ahead_id = images[i + 1].id if i + 1 < len(images) else past_id
+        behind_id = images[i - 1].id if i > 0 else before_id
+        next_id, previous_id = (behind_id, ahead_id) if backwards else (ahead_id, behind_id)
+        data.append(image_data_to_json(image, next_id, previous_id, spans.get(image.id)))
+    response = jsonify({'images': data})
+    response.headers['Link'] = ', '.join(
+        f'<{url_for("image_api.serve_image", path=image.file_url)}>; rel=preload; as=image' for image in images)
+    return response
 
 
 @image_api.route('/api/image/annotations/<image_id>', methods=['GET'])
@@ -355,7 +530,7 @@ def get_annotations(image_id):
     image = ensure_image_exists(image_id)
     if image is None:
         return jsonify({'message': 'there is no image with such an id'}), HTTPStatus.NOT_FOUND
-    if not can_access_bank(image.image_bank, current_user):
+    if not can_access_bank_id(image.image_bank_id, current_user):
         return jsonify({'message': 'not authorized to view this bank'}), HTTPStatus.UNAUTHORIZED
     return jsonify({
         'id': image.id,
@@ -363,11 +538,132 @@ def get_annotations(image_id):
     })
 
 
+def parse_coordinates(names):
+    """
+    Returns the values of the given query parameters as numbers, or `None`
+    if one is missing or is not a finite number.
+    """
+    try:
+        values = [float(request.args[name]) for name in names]
+    except (KeyError, ValueError):
+        return None
+    return values if all(map(math.isfinite, values)) else None
+
+
+@image_api.route('/api/image/<int:image_id>/regions-at', methods=['GET'])
+@login_required
+def get_regions_at(image_id):
+    """
+    Returns the annotations of the image whose region contains the point
+    given by the `x` and `y` query parameters, smallest region first.
+    """
+    point = parse_coordinates(('x', 'y'))
+    if point is None:
+        return jsonify({'message': 'ill-formed request'}), HTTPStatus.BAD_REQUEST
+    image = ensure_image_exists(str(image_id))
+    if image is None:
+        return jsonify({'message': 'there is no image with such an id'}), HTTPStatus.NOT_FOUND
+    if not can_access_bank_id(image.image_bank_id, current_user):
+        return jsonify({'message': 'not authorized to view this bank'}), HTTPStatus.UNAUTHORIZED
+    # the bounding boxes narrow the candidates down, the polygons decide
+    hits = []
+    for annotation in image_annotations_at(image.id, *point):
+        region = PolygonalRegion.from_coords(region_coords(annotation.region_info, annotation.region_data))
+        if region.contains(*point):
+            hits.append((region.area(), annotation))
+    hits.sort(key=lambda hit: hit[0])
+    return jsonify({
+        'id': image.id,
+        'annotations': [annotation_to_json(annotation) for _, annotation in hits],
+    })
+
+
+@image_api.route('/api/bank/<int:bank_id>/regions-in-box', methods=['GET'])
+@login_required
+def get_regions_in_box(bank_id):
+    """
+    Returns the annotations of the images of a bank whose region overlaps
+    the box given by the `x0`, `y0`, `x1` and `y1` query parameters (in
+    pixels of each image), by increasing id.
+
+    Optional query parameters: `limit` (maximal number of annotations
+    examined) and `after` (the `nextCursor` of the previous page); a page
+    can hold fewer than `limit` annotations.
+    """
+    box = parse_coordinates(('x0', 'y0', 'x1', 'y1'))
+    limit = request.args.get('limit', str(MAX_PAGE_SIZE))
+    after = request.args.get('after')
+    if box is None or not limit.isnumeric() or int(limit) < 1 or (after is not None and not after.isnumeric()):
+        return jsonify({'message': 'ill-formed request'}), HTTPStatus.BAD_REQUEST
+    if bank_id not in bank_levels(current_user.id):
+        return jsonify({'message': 'you do not have access to this bank'}), HTTPStatus.UNAUTHORIZED
+    min_x, max_x = sorted(box[0::2])
+    min_y, max_y = sorted(box[1::2])
+    limit = min(int(limit), MAX_PAGE_SIZE)
+    candidates = bank_annotations_in_box(bank_id, min_x, min_y, max_x, max_y,
+                                         after=int(after) if after is not None else None,
+                                         # one more, to know whether there is a next page
+                                         limit=limit + 1)
+    next_cursor = None
+    if len(candidates) > limit:
+        candidates = candidates[:limit]
+        next_cursor = candidates[-1].id if candidates else None
+    annotations = []
+    for annotation in candidates:
+        region = PolygonalRegion.from_coords(region_coords(annotation.region_info, annotation.region_data))
+        if region.intersects_box(min_x, min_y, max_x, max_y):
+            annotations.append(dict(annotation_to_json(annotation), imageId=annotation.image_id))
+    return jsonify({
+        'nextCursor': next_cursor,
+        'annotations': annotations,
+    })
+
+
 @image_api.route('/api/image-serve/<path:path>')
 def serve_image(path):
-    if path:
-        return send_file(os.path.join(default_bank_directory, path), mimetype='image/jpeg')
-    return jsonify({'message': 'no such image'}), HTTPStatus.NOT_FOUND
+    """
+    Serves an image of a bank. Responses carry an ETag (from the file's
+    stat) and a `Cache-Control` lifetime, and conditional and range requests
+    are honoured. With `IMAGE_ACCEL_REDIRECT` or `USE_X_SENDFILE`, the
+    front proxy sends the file instead of the worker.
+    """
+    file_path = safe_join(default_bank_directory, path)
+    if not os.path.isfile(file_path):
+        return jsonify({'message': 'no such image'}), HTTPStatus.NOT_FOUND
+    max_age = current_app.config['IMAGE_CACHE_MAX_AGE']
+    accel_prefix = current_app.config['IMAGE_ACCEL_REDIRECT']
+    if accel_prefix:
+        # the proxy handles the conditional and range requests of the file
+        response = Response(mimetype='image/jpeg')
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + quote(path)
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        return response
+    return send_from_directory(default_bank_directory, path, mimetype='image/jpeg',
+                               conditional=True, cache_timeout=max_age)
+
+
+@image_api.route('/api/thumbnail/<int:size>/<path:path>')
+def serve_thumbnail(path, size):
+    """
+    Serves a bank image downscaled to fit in a `size` x `size` square, one
+    of the `THUMBNAIL_SIZES`. Variants are generated on first request and
+    then served from the disk cache.
+    """
+    if size not in current_app.config['THUMBNAIL_SIZES']:
+        return jsonify({'message': 'unsupported thumbnail size'}), HTTPStatus.NOT_FOUND
+    file_path = safe_join(default_bank_directory, path)
+    # only the images of the banks have thumbnails (nor are the other files
+    # served as their fallback)
+    if not path.endswith('.jpg') or not os.path.isfile(file_path):
+        return jsonify({'message': 'no such image'}), HTTPStatus.NOT_FOUND
+    try:
+        thumbnail_path = get_thumbnail_cache(current_app.config).get(path, file_path, size)
+        return send_file(thumbnail_path, mimetype='image/jpeg', conditional=True,
+                         cache_timeout=current_app.config['IMAGE_CACHE_MAX_AGE'])
+    except OSError:
+        # unreadable image, or variant evicted meanwhile: serve the original
+        return serve_image(path)
 
 
 @image_api.route('/api/bank/json/<int:bank_id>')
@@ -378,22 +674,64 @@ def request_json(bank_id):
         return jsonify({'message': 'no such bank'}), HTTPStatus.NOT_FOUND
     if not can_access_bank(bank, current_user):
         return jsonify({'message': 'you cannot view this bank'}), HTTPStatus.UNAUTHORIZED
-    return {
+    header = {
         'id': bank.id,
         'name': bank.bankname,
         'description': bank.description,
-        'images': [
-            {
-                'id': image.id,
-                'description': image.description,
-                'width': image.width,
-                'height': image.height,
-                'relativePath': image.file_url,
-                'annotations': gen_annotation_array(image),
-            }
-            for image in bank.images
-        ],
     }
+    if request.args.get('format') == 'jsonl':
+        # JSON Lines: the bank, then one image per line
+        def generate_lines():
+            yield json.dumps(header) + '\n'
+            for image in iter_exported_images(bank_id):
+                yield json.dumps(image) + '\n'
+
+        return Response(stream_with_context(generate_lines()), mimetype='application/x-ndjson')
+
+    # a single JSON object, streamed image by image
+    def generate():
+        yield json.dumps(header)[:-1] + ', "images": ['
+        for i, image in enumerate(iter_exported_images(bank_id)):
+            yield (', ' if i else '') + json.dumps(image)
+        yield ']}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+def job_to_json(job):
+    return {
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'updatedAt': job.updated_at.isoformat(),
+    }
+
+
+@image_api.route('/api/discovery-status', methods=['GET'])
+@login_required
+def discovery_status():
+    """
+    Returns the status and progress of the latest discovery of the banks.
+    """
+    job = db.session.query(Job).filter(Job.kind == 'discovery').order_by(desc(Job.id)).first()
+    if job is None:
+        return jsonify({'status': 'none'})
+    return jsonify(job_to_json(job))
+
+
+@image_api.route('/api/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def job_status(job_id):
+    """
+    Returns the status and progress of a background job (eg the ingestion
+    of an uploaded bank).
+    """
+    job = db.session.query(Job).filter(Job.id == job_id).first()
+    if job is None:
+        return jsonify({'message': 'there is no job with such an id'}), HTTPStatus.NOT_FOUND
+    if job.user_id != current_user.id and current_user.username != 'admin':
+        return jsonify({'message': 'not authorized to view this job'}), HTTPStatus.UNAUTHORIZED
+    return jsonify(dict(job_to_json(job), id=job.id, kind=job.kind))
 
 
 @image_api.route('/api/bank/upload', methods=['POST'])
@@ -404,26 +742,21 @@ def upload_bank():
     archive = request.files['file']
     if not archive.filename.endswith('.zip'):
         return jsonify({'message': 'provided bank is not a zip archive'}), HTTPStatus.BAD_REQUEST
-    location = os.path.join(default_bank_directory, archive.filename)
     bankname = Path(archive.filename).stem
+    if not bankname or bankname.startswith('.'):
+        return jsonify({'message': 'ill-formed bank name'}), HTTPStatus.BAD_REQUEST
+    location = os.path.join(default_bank_directory, bankname + '.zip')
     bank_loc = os.path.join(default_bank_directory, bankname)
     if os.path.isdir(bank_loc):
         return jsonify({'message': 'a bank having this name already exists'}), HTTPStatus.BAD_REQUEST
     os.mkdir(bank_loc)
-    archive.save(location)
-    with zipfile.ZipFile(location, 'r') as z:
-        z.extractall(default_bank_directory)
-    os.remove(location)
-    new_bank, message = discover_bank(bank_loc)
-    # could not add bank (eg nothing inside)
-    if new_bank is None:
-        shutil.rmtree(bank_loc)
-        return jsonify({'message': message}), HTTPStatus.BAD_REQUEST
-    # OK
-    if current_user.username != 'admin':
-        db.session.add(BankAccess(current_user.id, new_bank.id, bank_access_levels['admin']))
-        db.session.commit()
-    return jsonify({'message': message})
+    save_archive(archive.stream, location)
+    # the super user already gets access to all banks
+    user_id = current_user.id if current_user.username != 'admin' else None
+    # extraction and discovery can take minutes: they run as a job, to poll at /api/jobs/<id>
+    job_id = start_job(current_app._get_current_object(), 'upload', ingest_bank,
+                       location, bank_loc, user_id, bank_access_levels['admin'], user_id=current_user.id)
+    return jsonify({'message': 'bank ' + bankname + ' is being added', 'jobId': job_id}), HTTPStatus.ACCEPTED
 
 
 @image_api.route('/api/bank/delete/<int:bank_id>', methods=['GET'])
@@ -432,8 +765,14 @@ def request_delete_bank(bank_id):
     bank = db.session.query(ImageBank).filter(ImageBank.id == bank_id).first()
     if bank is None or not can_access_bank(bank, current_user, access_level='admin'):
         return jsonify({'message': 'must be admin to delete a bank'}), HTTPStatus.UNAUTHORIZED
-    delete_bank(bank)
     bank_loc = os.path.join(default_bank_directory, bank.bankname)
+    if current_app.config['DELETE_BANKS_IN_BACKGROUND']:
+        # hide and rename the bank right away, and delete the rest by chunks in a job
+        deleting_loc = mark_bank_deleting(bank, bank_loc)
+        job_id = start_job(current_app._get_current_object(), 'delete_bank', delete_bank_by_chunks,
+                           bank.id, deleting_loc, user_id=current_user.id)
+        return jsonify({'message': 'OK', 'jobId': job_id}), HTTPStatus.ACCEPTED
+    delete_bank(bank)
     if os.path.isdir(bank_loc):
         shutil.rmtree(bank_loc)
     return jsonify({'message': 'OK'})
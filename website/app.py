@@ -1,12 +1,16 @@
-from flask import Flask, render_template
+from flask import Flask, current_app, render_template
 from flask_cors import CORS
 from flask_login import LoginManager
 import os
 
 from .config import config_by_name
-from .database.access import db
+from .database.access import db, init_database, init_query_counter
+from .database.migrations import upgrade_database, upgrade_lock
 from .database.models import User
-from .images.discovery import discover_all_banks
+from .database.users import get_user
+from .images.discovery import acquire_discovery_lock, discover_all_banks
+from .jobs import create_job, fail_abandoned_jobs, run_job, start_job
+from .passwords import compute_password_hash, verify_password_hash
 
 # configuration
 DEBUG = True
@@ -18,25 +22,43 @@ def create_super_user():
     if os.path.isfile('password.txt'):
         with open('password.txt', 'r') as file:
             password = file.read().strip()
+    # hashed by the current process: the password pool must not be created
+    # before the workers are forked
+    rounds = current_app.config['BCRYPT_LOG_ROUNDS']
     find = db.session.query(User).filter(User.username == 'admin').first()
-    from .apis.account_api import bcrypt
-    h = bcrypt.generate_password_hash(password)
     if find is None:
-        db.session.add(User('admin', 'none-required', h))
+        db.session.add(User('admin', 'none-required', compute_password_hash(password, rounds)))
         db.session.commit()
         print('added super user!')
-    elif find.password_hash != h:
+    elif not verify_password_hash(find.password_hash, password):
         # password update
-        find.password_hash = h
+        find.password_hash = compute_password_hash(password, rounds)
         db.session.commit()
         print('super user: changed password')
 
 
+def start_discovery(app):
+    """
+    Discovers the banks according to the `STARTUP_DISCOVERY` mode, if no
+    other worker does it already.
+    """
+    mode = app.config['STARTUP_DISCOVERY']
+    if mode == 'off' or not acquire_discovery_lock():
+        return
+    with app.app_context():
+        if mode == 'background':
+            start_job(app, 'discovery', discover_all_banks)
+        else:
+            run_job(create_job('discovery'), discover_all_banks)
+
+
 def create_app(config_name='default'):
     # create and configure the app
     app = Flask(__name__, static_folder='../dist/static', template_folder='../dist')
     app.config.from_object(config_by_name[config_name])
-    db.init_app(app)
+    init_database(app)
+    if app.config['COUNT_QUERIES']:
+        init_query_counter(app)
     # enable CORS
     # CORS(app, resources={r'/*': {'origins': '*'}})
     CORS(app, supports_credentials=True)
@@ -52,23 +74,28 @@ def create_app(config_name='default'):
     login_manager = LoginManager()
     login_manager.init_app(app)
     # Add CLI custom commands
-    from .cli import create_all, drop_all
+    from .cli import create_all, drop_all, upgrade_db, discover, precompute_suggestions, \
+        convert_regions, check_query_plans
     app.cli.add_command(create_all)
     app.cli.add_command(drop_all)
+    app.cli.add_command(upgrade_db)
+    app.cli.add_command(discover)
+    app.cli.add_command(precompute_suggestions)
+    app.cli.add_command(convert_regions)
+    app.cli.add_command(check_query_plans)
 
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(user_id)
+        return get_user(user_id)
 
-    # Add CLI custom commands
-    from .cli import create_all, drop_all
-    app.cli.add_command(create_all)
-    app.cli.add_command(drop_all)
-    # init database
-    with app.app_context():
-        db.create_all()
+    # init database, one worker at a time
+    with app.app_context(), upgrade_lock():
+        upgrade_database()
         create_super_user()
-        discover_all_banks()
+        abandoned = fail_abandoned_jobs()
+        if abandoned:
+            print(f'> marked {abandoned} interrupted job(s) as failed')
+    start_discovery(app)
 
     # render main page
     @app.route('/', defaults={'path': ''})
@@ -81,7 +108,8 @@ def create_app(config_name='default'):
     return app
 
 
-app = create_app()
+# 'default', 'development', 'testing' or 'production'
+app = create_app(os.environ.get('APP_CONFIG', config_name))
 
 
 if __name__ == '__main__':
@@ -1,4 +1,5 @@
 import click
+from flask import current_app
 from flask.cli import with_appcontext
 
 from .database.access import db
@@ -14,3 +15,77 @@ def create_all():
 @with_appcontext
 def drop_all():
     db.drop_all()
+
+
+@click.command('upgrade_db', help='Add the missing tables, columns and indexes to an existing database')
+@with_appcontext
+def upgrade_db():
+    from .database.migrations import upgrade_database, upgrade_lock
+    with upgrade_lock():
+        upgrade_database()
+
+
+@click.command('discover', help='Discover the banks (for STARTUP_DISCOVERY = off)')
+@with_appcontext
+def discover():
+    from .images.discovery import discover_all_banks
+    from .jobs import create_job, run_job
+    run_job(create_job('discovery'), discover_all_banks)
+
+
+@click.command('precompute_suggestions', help='Precompute the suggestions of the images of every bank')
+@with_appcontext
+def precompute_suggestions():
+    from .database.models import ImageBank
+    from .images.banks import is_bank_deleting
+    from .textproc.precompute import precompute_bank_suggestions
+    if not current_app.config['PRECOMPUTE_SUGGESTIONS']:
+        print('> PRECOMPUTE_SUGGESTIONS is off: the precomputed suggestions will not be served')
+    for bank in db.session.query(ImageBank).all():
+        if is_bank_deleting(bank):
+            continue
+        count = precompute_bank_suggestions(bank.id)
+        print('> ' + bank.bankname + ': precomputed suggestions of ' + str(count) + ' images')
+
+
+@click.command('convert_regions', help='Store the regions of all annotations with the given storage')
+@click.option('--to', 'storage', type=click.Choice(['text', 'packed', 'varint']), required=True)
+@click.option('--batch-size', default=1000, help='Number of annotations converted per transaction')
+@with_appcontext
+def convert_regions(storage, batch_size):
+    from .database.models import ImageAnnotation
+    from .images.codec import region_columns, region_text, text_to_coords
+    last_id = 0
+    converted = 0
+    while True:
+        rows = db.session.query(ImageAnnotation.id, ImageAnnotation.region_info, ImageAnnotation.region_data) \
+            .filter(ImageAnnotation.id > last_id) \
+            .order_by(ImageAnnotation.id) \
+            .limit(batch_size) \
+            .all()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            text = region_text(row.region_info, row.region_data)
+            if text is None:
+                continue
+            region_info, region_data = region_columns(text_to_coords(text), storage)
+            updates.append({'id': row.id, 'region_info': region_info, 'region_data': region_data})
+        db.session.bulk_update_mappings(ImageAnnotation, updates)
+        db.session.commit()
+        converted += len(updates)
+        last_id = rows[-1].id
+    print('> converted ' + str(converted) + ' annotations to ' + storage)
+
+
+@click.command('check_query_plans', help='Check that the hot queries use indexes (SQLite only)')
+@with_appcontext
+def check_query_plans():
+    from .database.plans import check_query_plans
+    if db.engine.dialect.name != 'sqlite':
+        raise click.ClickException('query plans are only checked on SQLite')
+    scanning = check_query_plans()
+    if scanning:
+        raise click.ClickException('queries scanning a table: ' + ', '.join(scanning))
+    print('> all hot queries use indexes')
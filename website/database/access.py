@@ -1,3 +1,60 @@
+import sqlite3
+
+from flask import g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
 
 db = SQLAlchemy()
+
+
+def init_database(app):
+    """
+    Sets up `db` for the app. SQLite databases get a pool of connections
+    if `pool_size` is set (Flask-SQLAlchemy opens a connection per session
+    otherwise), and the `SQLITE_PRAGMAS` on each new connection.
+    """
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    options = dict(app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+    if url.get_backend_name() == 'sqlite' and options.get('pool_size'):
+        options.setdefault('poolclass', QueuePool)
+        # pooled connections are shared by the threads of the worker
+        options['connect_args'] = dict(options.get('connect_args', {}), check_same_thread=False)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    db.init_app(app)
+    pragmas = app.config['SQLITE_PRAGMAS']
+    if not pragmas or url.get_backend_name() != 'sqlite':
+        return
+
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+    with app.app_context():
+        event.listen(db.engine, 'connect', set_sqlite_pragmas)
+
+
+def init_query_counter(app):
+    """
+    Counts the SQL queries run by each request and reports them in the
+    `X-Query-Count` response header, so that the number of queries per
+    endpoint can be checked (see `tests/test_query_counts.py`).
+    """
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            g.query_count = g.get('query_count', 0) + 1
+
+    # on the app's engine only, so that the counts of several apps (eg in
+    # the tests) do not add up
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count_query)
+
+    @app.after_request
+    def report_query_count(response):
+        response.headers['X-Query-Count'] = str(g.get('query_count', 0))
+        return response
@@ -0,0 +1,74 @@
+"""
+Process-level caches of values loaded from the database, shared across the
+requests of a worker.
+"""
+from collections import OrderedDict
+from threading import Lock
+import time
+
+
+class ExpiringCache:
+    """
+    LRU cache whose entries are valid for a fixed time, loaded on a miss by
+    a function of the key. The values are shared: they must be immutable
+    (or never modified).
+
+    The changes made by this process are applied with `invalidate`; those
+    made by other processes are seen once the entries expire.
+    """
+
+    def __init__(self, capacity, load):
+        """
+        :param capacity: maximal number of entries
+        :param load: function returning the value of a key from the
+            database, or `None` if there is none (not cached)
+        """
+        self.capacity = capacity
+        self.load = load
+        self.lock = Lock()
+        # (expiry time, value), by key
+        self.entries = OrderedDict()
+        # incremented by each invalidation, so that values loaded before it
+        # are not stored after it
+        self.generation = 0
+
+    def get(self, key, ttl):
+        """
+        Returns the value of the given key, loading it if it is not cached
+        or expired.
+
+        :param ttl: time during which a loaded value is valid, in seconds
+            (0: not cached)
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                return entry[1]
+            generation = self.generation
+        value = self.load(key)
+        with self.lock:
+            if value is not None and ttl > 0 and generation == self.generation:
+                self.entries[key] = (now + ttl, value)
+                self.entries.move_to_end(key)
+                if len(self.entries) > self.capacity:
+                    self.entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key):
+        """
+        Forgets the value of the given key.
+        """
+        with self.lock:
+            self.generation += 1
+            self.entries.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """
+        Forgets the values for which `predicate` is true.
+        """
+        with self.lock:
+            self.generation += 1
+            for key in [key for key, (_, value) in self.entries.items() if predicate(value)]:
+                del self.entries[key]
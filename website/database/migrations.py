@@ -0,0 +1,187 @@
+"""
+Upgrades existing databases to the current models: `db.create_all` only
+creates the missing tables, not the columns or indexes added to existing
+ones.
+"""
+from contextlib import contextmanager
+import os
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, where the app runs in a single process
+    fcntl = None
+
+from sqlalchemy import and_, func, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+
+from .access import db
+from .models import BankAccess, ImageAnnotation, ImageToAnnotate, UserSelectedKeyword
+from ..images.codec import region_coords
+from ..images.geometry import PolygonalRegion
+
+# number of annotations whose bounding box is computed per query
+BACKFILL_BATCH_SIZE = 1000
+# file locked by the process upgrading the database
+UPGRADE_LOCK_FILE = os.path.join(os.getcwd(), 'upgrade.lock')
+
+
+def backfill_image_summaries():
+    """
+    Computes the annotation summary of every image. As annotations have no
+    timestamp, the author of the newest one is taken as the last editor.
+    """
+    image = ImageToAnnotate.__table__
+    annotation = ImageAnnotation.__table__
+    db.session.execute(image.update().values(
+        annotation_count=select(func.count(annotation.c.id))
+        .where(annotation.c.image_id == image.c.id)
+        .scalar_subquery(),
+        last_editor_id=select(annotation.c.author_id)
+        .where(annotation.c.image_id == image.c.id)
+        .order_by(annotation.c.id.desc())
+        .limit(1)
+        .scalar_subquery(),
+    ))
+
+
+def backfill_annotation_bounds():
+    """
+    Computes the bounding box of the region of every annotation.
+    """
+    last_id = 0
+    while True:
+        rows = db.session.query(ImageAnnotation.id, ImageAnnotation.region_info, ImageAnnotation.region_data) \
+            .filter(ImageAnnotation.id > last_id) \
+            .order_by(ImageAnnotation.id) \
+            .limit(BACKFILL_BATCH_SIZE) \
+            .all()
+        if not rows:
+            return
+        updates = []
+        for row in rows:
+            if row.region_info is None and row.region_data is None:
+                continue
+            region = PolygonalRegion.from_coords(region_coords(row.region_info, row.region_data))
+            min_x, min_y, max_x, max_y = region.bounds()
+            updates.append({'id': row.id, 'min_x': int(min_x), 'min_y': int(min_y),
+                            'max_x': int(max_x), 'max_y': int(max_y)})
+        db.session.bulk_update_mappings(ImageAnnotation, updates)
+        last_id = rows[-1].id
+
+
+# data to compute when a column gets added, by (table, column)
+BACKFILLS = {
+    ('image', 'annotation_count'): backfill_image_summaries,
+    ('annotation', 'min_x'): backfill_annotation_bounds,
+}
+
+
+def deduplicate_bank_accesses():
+    """
+    Keeps a single access per user and bank, with the highest level of the
+    duplicated ones.
+    """
+    access = BankAccess.__table__
+    other = access.alias()
+    db.session.execute(access.update().values(
+        permission_level=select(func.max(other.c.permission_level))
+        .where(and_(other.c.user_id == access.c.user_id, other.c.bank_id == access.c.bank_id))
+        .scalar_subquery(),
+    ))
+    db.session.execute(access.delete().where(access.c.id.not_in(
+        select(func.min(access.c.id)).group_by(access.c.user_id, access.c.bank_id))))
+
+
+def deduplicate_user_keywords():
+    """
+    Keeps the first occurrence of each keyword of a bank.
+    """
+    keyword = UserSelectedKeyword.__table__
+    db.session.execute(keyword.delete().where(keyword.c.id.not_in(
+        select(func.min(keyword.c.id)).group_by(keyword.c.image_bank_id, keyword.c.keyword))))
+
+
+# duplicated rows to remove before a unique index gets added, by index name
+DEDUPLICATIONS = {
+    'uq_bank_access_user_bank': deduplicate_bank_accesses,
+    'uq_user_keywords_bank_keyword': deduplicate_user_keywords,
+}
+
+
+def add_missing_columns():
+    """
+    Adds to the existing tables the columns of the models they lack, and
+    returns them as `(table, column)` pairs.
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            db.session.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            added.append((table.name, column.name))
+    return added
+
+
+def add_missing_indexes():
+    """
+    Creates the indexes of the models that the existing tables lack, and
+    returns their names. The duplicated rows that a unique index forbids are
+    removed first when `DEDUPLICATIONS` knows how to; otherwise the index is
+    skipped with a warning, to be added once the duplicates are fixed.
+    """
+    inspector = inspect(db.engine)
+    added = []
+    for table in db.metadata.sorted_tables:
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            if index.name in DEDUPLICATIONS:
+                DEDUPLICATIONS[index.name]()
+                db.session.commit()
+            try:
+                index.create(bind=db.engine)
+            except IntegrityError:
+                print('> could not add unique index ' + index.name + ': ' + table.name + ' has duplicated rows')
+                continue
+            added.append(index.name)
+    return added
+
+
+@contextmanager
+def upgrade_lock():
+    """
+    Holds the lock of the database upgrades, waiting for it if needed: the
+    workers started together upgrade the database one after the other (the
+    next ones find nothing to add), rather than altering it at once.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(UPGRADE_LOCK_FILE, 'a') as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        yield
+
+
+def upgrade_database():
+    """
+    Creates the missing tables, columns and indexes, and fills in the data
+    of the new columns. To call while holding `upgrade_lock`.
+    """
+    db.create_all()
+    added = add_missing_columns()
+    for key in added:
+        print('> added column ' + '.'.join(key))
+        if key in BACKFILLS:
+            BACKFILLS[key]()
+    db.session.commit()
+    for name in add_missing_indexes():
+        print('> added index ' + name)
+    return added
@@ -1,3 +1,5 @@
+import datetime
+
 from sqlalchemy.orm import relationship
 from .access import db
 from flask_login import UserMixin
@@ -54,6 +56,10 @@ class BankAccess(db.Model):
     Note: We might want to allow different bank visibility levels.
     """
     __tablename__ = 'bank_access'
+    # a user has at most one access per bank; the bank's accesses are listed
+    # by the access management
+    __table_args__ = (db.Index('uq_bank_access_user_bank', 'user_id', 'bank_id', unique=True),
+                      db.Index('ix_bank_access_bank_id', 'bank_id'))
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
@@ -73,6 +79,10 @@ class ImageToAnnotate(db.Model):
     Represents an image to annotate.
     """
     __tablename__ = 'image'
+    # serves the listing of a bank by pages and the next/previous lookups; a
+    # file is discovered at most once per bank
+    __table_args__ = (db.Index('ix_image_bank_id_id', 'image_bank_id', 'id'),
+                      db.Index('uq_image_bank_file_url', 'image_bank_id', 'file_url', unique=True))
 
     id = db.Column(db.Integer, primary_key=True)
     image_bank_id = db.Column(db.Integer, db.ForeignKey('image_bank.id'))
@@ -82,9 +92,13 @@ class ImageToAnnotate(db.Model):
     # to avoid to have to fetch it each time from the file system
     width = db.Column(db.SmallInteger)
     height = db.Column(db.SmallInteger)
+    # summary of the annotations, kept up to date when they are saved
+    last_editor_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    last_modified = db.Column(db.DateTime)
+    annotation_count = db.Column(db.Integer, default=0)
 
     image_bank = relationship('ImageBank', back_populates='images')
-    annotations = relationship('ImageAnnotation', back_populates='image')
+    annotations = relationship('ImageAnnotation', back_populates='image', order_by='ImageAnnotation.id')
 
     def __init__(self, image_bank_id, file_url, description, width, height):
         self.image_bank_id = image_bank_id
@@ -92,6 +106,7 @@ class ImageToAnnotate(db.Model):
         self.description = description
         self.width = width
         self.height = height
+        self.annotation_count = 0
 
 
 class ImageAnnotation(db.Model):
@@ -99,24 +114,79 @@ class ImageAnnotation(db.Model):
     Represents an annotation on an `ImageToAnnotate`.
     """
     __tablename__ = 'annotation'
+    # the bounding box index also serves the lookups by image
+    __table_args__ = (db.Index('ix_annotation_image_bbox', 'image_id', 'min_x', 'max_x', 'min_y', 'max_y'),
+                      db.Index('ix_annotation_author_id', 'author_id'))
 
     id = db.Column(db.Integer, primary_key=True)
     image_id = db.Column(db.Integer, db.ForeignKey('image.id'))
     text_start = db.Column(db.SmallInteger)
     text_end = db.Column(db.SmallInteger)
+    # the region as `"x,y;x,y;..."` text, or `None` if stored in `region_data`
     region_info = db.Column(db.String())
+    # the region encoded by `images.codec` (see `REGION_STORAGE`)
+    region_data = db.Column(db.LargeBinary)
+    # bounding box of the region, for the spatial queries
+    min_x = db.Column(db.Integer)
+    min_y = db.Column(db.Integer)
+    max_x = db.Column(db.Integer)
+    max_y = db.Column(db.Integer)
     author_id = db.Column(db.Integer, db.ForeignKey('user.id'))
 
     image = relationship('ImageToAnnotate', back_populates='annotations')
     # The user responsible for this annotation
     author = relationship('User', back_populates='annotations')
 
-    def __init__(self, image_id, text_start, text_end, region_info, author_id):
+    def __init__(self, image_id, text_start, text_end, region_info, author_id, region_data=None, bounds=None):
         self.image_id = image_id
         self.text_start = text_start
         self.text_end = text_end
         self.region_info = region_info
         self.author_id = author_id
+        self.region_data = region_data
+        if bounds is not None:
+            self.min_x, self.min_y, self.max_x, self.max_y = bounds
+
+
+class BankFile(db.Model):
+    """
+    Represents a file of a bank's folder as seen by the last discovery of
+    the bank, so that files whose stat did not change are not read again.
+    """
+    __tablename__ = 'bank_file'
+    __table_args__ = (db.UniqueConstraint('bank_id', 'path'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    bank_id = db.Column(db.Integer, db.ForeignKey('image_bank.id'))
+    # file name, relative to the bank's folder
+    path = db.Column(db.String())
+    # modification time, in nanoseconds
+    mtime = db.Column(db.BigInteger)
+    size = db.Column(db.BigInteger)
+
+    def __init__(self, bank_id, path, mtime, size):
+        self.bank_id = bank_id
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+
+
+class ImageSuggestion(db.Model):
+    """
+    Represents the termlist suggestions precomputed for an image, for a
+    given version of the termlists.
+    """
+    __tablename__ = 'image_suggestion'
+
+    image_id = db.Column(db.Integer, db.ForeignKey('image.id'), primary_key=True)
+    termlist_hash = db.Column(db.String(40), primary_key=True)
+    # spans serialized as "start,end;start,end;..."
+    spans = db.Column(db.String())
+
+    def __init__(self, image_id, termlist_hash, spans):
+        self.image_id = image_id
+        self.termlist_hash = termlist_hash
+        self.spans = spans
 
 
 class UserSelectedKeyword(db.Model):
@@ -124,6 +194,8 @@ class UserSelectedKeyword(db.Model):
     Represents user-selected keywords.
     """
     __tablename__ = 'user_keywords'
+    # a keyword is stored once per bank
+    __table_args__ = (db.Index('uq_user_keywords_bank_keyword', 'image_bank_id', 'keyword', unique=True),)
 
     id = db.Column(db.Integer, primary_key=True)
     image_bank_id = db.Column(db.Integer, db.ForeignKey('image_bank.id'))
@@ -134,3 +206,35 @@ class UserSelectedKeyword(db.Model):
     def __init__(self, image_bank_id, keyword):
         self.image_bank_id = image_bank_id
         self.keyword = keyword
+
+
+class Job(db.Model):
+    """
+    Represents a background job (eg the discovery of the banks), with its
+    status and progress so that any worker process can report them.
+    """
+    __tablename__ = 'job'
+    # serves the lookup of the latest job of a kind
+    __table_args__ = (db.Index('ix_job_kind_id', 'kind', 'id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30))
+    # one of 'queued', 'running', 'done' or 'failed'
+    status = db.Column(db.String(10))
+    # counters, eg {"banks": 3, "banksDone": 1}
+    progress = db.Column(db.JSON)
+    message = db.Column(db.String())
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    # token of the process running the job (see `jobs.get_job_runner`)
+    runner = db.Column(db.String(32))
+    # user who started the job, the only one (with the super user) who can
+    # follow it; none for the jobs of the app (eg the discovery at startup)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+
+    def __init__(self, kind, runner, user_id=None, status='queued'):
+        self.kind = kind
+        self.runner = runner
+        self.user_id = user_id
+        self.status = status
+        self.progress = {}
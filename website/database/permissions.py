@@ -0,0 +1,58 @@
+"""
+Resolution of the users' permissions on the banks: the `{bank_id: level}`
+map of a user is loaded in one query, kept for the rest of the request in
+`flask.g`, and shared across the requests of the process by a small cache
+whose entries expire after `PERMISSION_CACHE_TTL` seconds.
+"""
+from flask import current_app, g, has_request_context
+
+from .access import db
+from .caching import ExpiringCache
+from .models import BankAccess
+
+# number of users whose permissions are kept in memory
+PERMISSION_CACHE_USERS = 1024
+
+
+def load_bank_levels(user_id):
+    """
+    Returns the `{bank_id: level}` map of the given user, from the database.
+    """
+    return dict(db.session.query(BankAccess.bank_id, BankAccess.permission_level)
+                .filter(BankAccess.user_id == user_id))
+
+
+permission_cache = ExpiringCache(PERMISSION_CACHE_USERS, load_bank_levels)
+
+
+def bank_levels(user_id):
+    """
+    Returns the `{bank_id: level}` map of the banks the given user can
+    access, resolved once per request.
+    """
+    if not has_request_context():
+        return permission_cache.get(user_id, current_app.config['PERMISSION_CACHE_TTL'])
+    levels_by_user = g.setdefault('bank_levels', {})
+    levels = levels_by_user.get(user_id)
+    if levels is None:
+        levels = permission_cache.get(user_id, current_app.config['PERMISSION_CACHE_TTL'])
+        levels_by_user[user_id] = levels
+    return levels
+
+
+def invalidate_user_permissions(user_id):
+    """
+    To call once a change of the accesses of the given user is committed.
+    """
+    permission_cache.invalidate(user_id)
+    if has_request_context():
+        g.get('bank_levels', {}).pop(user_id, None)
+
+
+def invalidate_bank_permissions(bank_id):
+    """
+    To call once a change of the accesses to the given bank is committed.
+    """
+    permission_cache.invalidate_where(lambda levels: bank_id in levels)
+    if has_request_context():
+        g.pop('bank_levels', None)
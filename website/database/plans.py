@@ -0,0 +1,89 @@
+"""
+Query plan checks of the hot queries of the API, discovery and jobs: each
+must look its rows up through an index rather than scan its tables (see
+the `check_query_plans` command). Only SQLite's plans are checked.
+"""
+from sqlalchemy import and_, desc, func
+
+from .access import db
+from .models import BankAccess, BankFile, ImageAnnotation, ImageSuggestion, ImageToAnnotate, Job, User, \
+    UserSelectedKeyword
+
+
+def hot_queries():
+    """
+    Returns the hot queries, by name, with placeholder parameters.
+    """
+    return {
+        'bank listing page': db.session.query(ImageToAnnotate.id, ImageToAnnotate.file_url,
+                                              User.username.label('last_editor'))
+        .outerjoin(User, User.id == ImageToAnnotate.last_editor_id)
+        .filter(ImageToAnnotate.image_bank_id == 1, ImageToAnnotate.id > 0)
+        .order_by(ImageToAnnotate.id)
+        .limit(100),
+        'next image': db.session.query(func.min(ImageToAnnotate.id))
+        .filter(and_(ImageToAnnotate.image_bank_id == 1, ImageToAnnotate.id > 1)),
+        'image by file url': db.session.query(ImageToAnnotate.id)
+        .filter(ImageToAnnotate.image_bank_id == 1, ImageToAnnotate.file_url == 'bank/image.jpg'),
+        'bank files of discovery': db.session.query(ImageToAnnotate.file_url, ImageToAnnotate.id)
+        .filter(ImageToAnnotate.image_bank_id == 1),
+        'bank manifest': db.session.query(BankFile.path, BankFile.mtime, BankFile.size)
+        .filter(BankFile.bank_id == 1),
+        'image annotations': db.session.query(ImageAnnotation)
+        .filter(ImageAnnotation.image_id.in_([1, 2])),
+        'annotations at point': db.session.query(ImageAnnotation.id)
+        .filter(ImageAnnotation.image_id == 1, ImageAnnotation.min_x <= 5, ImageAnnotation.max_x >= 5,
+                ImageAnnotation.min_y <= 5, ImageAnnotation.max_y >= 5),
+        'annotations of author': db.session.query(ImageAnnotation.id)
+        .filter(ImageAnnotation.author_id == 1),
+        'accesses of user': db.session.query(BankAccess)
+        .filter(BankAccess.user_id == 1),
+        'access of user to bank': db.session.query(BankAccess)
+        .filter(BankAccess.user_id == 1, BankAccess.bank_id == 1),
+        'accesses of bank': db.session.query(BankAccess)
+        .filter(BankAccess.bank_id == 1),
+        'known keywords': db.session.query(UserSelectedKeyword.keyword)
+        .filter(and_(UserSelectedKeyword.image_bank_id == 1,
+                     UserSelectedKeyword.keyword.in_(['wing', 'antenna']))),
+        'new keywords': db.session.query(UserSelectedKeyword.id, UserSelectedKeyword.keyword)
+        .filter(and_(UserSelectedKeyword.image_bank_id == 1, UserSelectedKeyword.id > 0))
+        .order_by(UserSelectedKeyword.id),
+        'image suggestions': db.session.query(ImageSuggestion.spans)
+        .filter(ImageSuggestion.image_id == 1, ImageSuggestion.termlist_hash == ''),
+        'latest discovery job': db.session.query(Job)
+        .filter(Job.kind == 'discovery')
+        .order_by(desc(Job.id))
+        .limit(1),
+    }
+
+
+def query_plan(query):
+    """
+    Returns the lines of the SQLite query plan of a query.
+    """
+    sql = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})
+    return [row[-1] for row in db.session.execute(db.text('EXPLAIN QUERY PLAN ' + str(sql)))]
+
+
+def is_table_scan(line):
+    """
+    Returns `True` iff a line of a query plan reads a whole table (a `SCAN`
+    of the table rather than of one of its indexes).
+    """
+    return line.startswith('SCAN ') and ' USING ' not in line and 'CONSTANT ROW' not in line
+
+
+def check_query_plans():
+    """
+    Prints the plan of every hot query, and returns the names of those that
+    scan a table.
+    """
+    scanning = []
+    for name, query in hot_queries().items():
+        plan = query_plan(query)
+        print('> ' + name)
+        for line in plan:
+            print('>> ' + line)
+        if any(is_table_scan(line) for line in plan):
+            scanning.append(name)
+    return scanning
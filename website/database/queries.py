@@ -0,0 +1,139 @@
+"""
+Read queries of the API's views. Each fetches what its view needs in a
+fixed, small number of SQL queries, whatever the size of the bank.
+"""
+from sqlalchemy import and_, func
+from sqlalchemy.orm import joinedload, selectinload
+
+from .access import db
+from .models import ImageAnnotation, ImageBank, ImageToAnnotate, User
+
+
+def bank_name(bank_id):
+    """
+    Returns the name of the given bank, or `None` if it does not exist.
+    """
+    row = db.session.query(ImageBank.bankname).filter(ImageBank.id == bank_id).first()
+    return row.bankname if row is not None else None
+
+
+def bank_image_listing(bank_id, after=None, limit=None, annotated=None, editor=None):
+    """
+    Returns the `(id, file_url, description, annotation_count, last_editor)`
+    rows of the images of a bank by increasing id, in one query;
+    `last_editor` is the username of the last user who saved annotations
+    of the image.
+
+    :param after: only list images with a greater id (keyset pagination)
+    :param limit: maximal number of rows
+    :param annotated: if not `None`, only list images that have (`True`)
+        or do not have (`False`) annotations
+    :param editor: only list images last edited by this username
+    """
+    query = db.session.query(ImageToAnnotate.id, ImageToAnnotate.file_url, ImageToAnnotate.description,
+                             ImageToAnnotate.annotation_count, User.username.label('last_editor')) \
+        .outerjoin(User, User.id == ImageToAnnotate.last_editor_id) \
+        .filter(ImageToAnnotate.image_bank_id == bank_id)
+    if after is not None:
+        query = query.filter(ImageToAnnotate.id > after)
+    if annotated is not None:
+        query = query.filter(ImageToAnnotate.annotation_count > 0 if annotated
+                             else ImageToAnnotate.annotation_count == 0)
+    if editor is not None:
+        query = query.filter(User.username == editor)
+    query = query.order_by(ImageToAnnotate.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
+def image_with_annotations(image_id):
+    """
+    Returns the given image with its bank, annotations and their authors
+    already loaded (two queries), or `None` if it does not exist.
+    """
+    return db.session.query(ImageToAnnotate) \
+        .options(joinedload(ImageToAnnotate.image_bank),
+                 selectinload(ImageToAnnotate.annotations).joinedload(ImageAnnotation.author)) \
+        .filter(ImageToAnnotate.id == image_id) \
+        .first()
+
+
+def image_window(image_id, count, backwards=False):
+    """
+    Returns the given image followed by the next `count - 1` images of its
+    bank (the previous ones if `backwards`), in that order, with their
+    annotations and authors loaded (two queries), and the id of the image
+    past the window (`None` if there is none). The list is empty if the
+    image does not exist.
+    """
+    bank_id = db.session.query(ImageToAnnotate.image_bank_id) \
+        .filter(ImageToAnnotate.id == image_id) \
+        .scalar_subquery()
+    query = db.session.query(ImageToAnnotate) \
+        .options(selectinload(ImageToAnnotate.annotations).joinedload(ImageAnnotation.author)) \
+        .filter(ImageToAnnotate.image_bank_id == bank_id)
+    if backwards:
+        query = query.filter(ImageToAnnotate.id <= image_id).order_by(ImageToAnnotate.id.desc())
+    else:
+        query = query.filter(ImageToAnnotate.id >= image_id).order_by(ImageToAnnotate.id)
+    # one more image, to know the one past the window
+    images = query.limit(count + 1).all()
+    if not images or images[0].id != image_id:
+        return [], None
+    return images[:count], images[count].id if len(images) > count else None
+
+
+def neighbour_image_ids(image):
+    """
+    Returns the ids of the next and previous images of the image's bank
+    (`None` when there is none), in one query.
+    """
+    next_id = db.session.query(func.min(ImageToAnnotate.id)) \
+        .filter(and_(ImageToAnnotate.image_bank_id == image.image_bank_id,
+                     ImageToAnnotate.id > image.id)) \
+        .scalar_subquery()
+    previous_id = db.session.query(func.max(ImageToAnnotate.id)) \
+        .filter(and_(ImageToAnnotate.image_bank_id == image.image_bank_id,
+                     ImageToAnnotate.id < image.id)) \
+        .scalar_subquery()
+    return db.session.query(next_id, previous_id).one()
+
+
+def annotation_columns():
+    return (ImageAnnotation.id, ImageAnnotation.image_id, ImageAnnotation.text_start,
+            ImageAnnotation.text_end, ImageAnnotation.region_info, ImageAnnotation.region_data)
+
+
+def image_annotations_at(image_id, x, y):
+    """
+    Returns the annotations of an image whose bounding box contains the
+    point `(x, y)`, in one query.
+    """
+    return db.session.query(*annotation_columns()) \
+        .filter(ImageAnnotation.image_id == image_id,
+                ImageAnnotation.min_x <= x, ImageAnnotation.max_x >= x,
+                ImageAnnotation.min_y <= y, ImageAnnotation.max_y >= y) \
+        .order_by(ImageAnnotation.id) \
+        .all()
+
+
+def bank_annotations_in_box(bank_id, min_x, min_y, max_x, max_y, after=None, limit=None):
+    """
+    Returns the annotations of the images of a bank whose bounding box
+    overlaps the given box, by increasing id, in one query.
+
+    :param after: only return annotations with a greater id (keyset pagination)
+    :param limit: maximal number of rows
+    """
+    query = db.session.query(*annotation_columns()) \
+        .join(ImageToAnnotate, ImageToAnnotate.id == ImageAnnotation.image_id) \
+        .filter(ImageToAnnotate.image_bank_id == bank_id,
+                ImageAnnotation.min_x <= max_x, ImageAnnotation.max_x >= min_x,
+                ImageAnnotation.min_y <= max_y, ImageAnnotation.max_y >= min_y)
+    if after is not None:
+        query = query.filter(ImageAnnotation.id > after)
+    query = query.order_by(ImageAnnotation.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
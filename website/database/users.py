@@ -0,0 +1,73 @@
+"""
+The users of the sessions: rather than a `User` row loaded on each request,
+`current_user` is an immutable snapshot of the user, shared across the
+requests of the process by a cache whose entries expire after
+`USER_CACHE_TTL` seconds (like the permissions of the users, see
+`permissions.py`).
+"""
+from collections import namedtuple
+
+from flask import current_app
+from flask_login import UserMixin
+
+from .access import db
+from .caching import ExpiringCache
+from .models import User
+
+# number of users kept in memory
+USER_CACHE_USERS = 1024
+
+
+class UserSnapshot(namedtuple('UserSnapshot', ['id', 'username', 'email', 'has_profile_picture']), UserMixin):
+    """
+    The fields of a `User` needed by the requests, without its password
+    hash. Changes are made to the `User` row, followed by
+    `invalidate_user`. Its permissions on the banks are resolved by
+    `permissions.bank_levels`.
+    """
+
+
+def load_user_snapshot(user_id):
+    row = db.session.query(User.id, User.username, User.email, User.has_profile_picture) \
+        .filter(User.id == user_id) \
+        .first()
+    return UserSnapshot(*row) if row is not None else None
+
+
+def load_user_snapshot_by_name(username):
+    row = db.session.query(User.id, User.username, User.email, User.has_profile_picture) \
+        .filter(User.username == username) \
+        .first()
+    return UserSnapshot(*row) if row is not None else None
+
+
+user_cache = ExpiringCache(USER_CACHE_USERS, load_user_snapshot)
+# the same snapshots, by username (for the profiles and avatars)
+user_by_name_cache = ExpiringCache(USER_CACHE_USERS, load_user_snapshot_by_name)
+
+
+def get_user(user_id):
+    """
+    Returns the snapshot of the given user, or `None` if there is none.
+
+    :param user_id: the id of the user, as stored in the session
+    """
+    if not str(user_id).isnumeric():
+        return None
+    return user_cache.get(int(user_id), current_app.config['USER_CACHE_TTL'])
+
+
+def get_user_by_name(username):
+    """
+    Returns the snapshot of the user with the given name, or `None` if there
+    is none.
+    """
+    return user_by_name_cache.get(username, current_app.config['USER_CACHE_TTL'])
+
+
+def invalidate_user(user_id):
+    """
+    To call once a change of the given user is committed.
+    """
+    user_cache.invalidate(user_id)
+    user_by_name_cache.invalidate_where(lambda user: user.id == user_id)
@@ -0,0 +1,128 @@
+"""
+Avatars of the users, served in the fixed `AVATAR_SIZES`.
+
+The uploaded pictures are kept as they are, and their variants are
+generated by a `ThumbnailCache` (in the background at upload time, or on
+first request). As a variant is keyed by its source's stat, uploading a new
+picture gives new variants. The most requested variants, with the default
+picture's ones, are kept encoded in memory.
+"""
+from collections import OrderedDict
+import os
+import threading
+
+from PIL import Image
+
+from .thumbnails import ThumbnailCache
+
+# key of the default picture's variants (usernames are keyed 'user:<name>')
+DEFAULT_AVATAR_KEY = 'default'
+
+
+def avatar_key(username):
+    return 'user:' + username
+
+
+def verify_picture(stream):
+    """
+    Returns `True` iff the given stream holds an image that PIL can read.
+    The stream is rewound.
+    """
+    try:
+        with Image.open(stream) as image:
+            image.verify()
+        return True
+    except Exception:
+        return False
+    finally:
+        stream.seek(0)
+
+
+class AvatarCache:
+    """
+    Process-level LRU cache of the encoded variants of the avatars, with
+    their ETag, bounded in bytes.
+    """
+
+    def __init__(self, variants, sizes, max_bytes):
+        """
+        :param variants: the `ThumbnailCache` generating the variants
+        :param sizes: the sizes of the variants
+        :param max_bytes: maximal total size of the variants kept in memory
+        """
+        self.variants = variants
+        self.sizes = sizes
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # (etag, data), by variant path
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+    def get(self, key, source_path, size):
+        """
+        Returns the `(etag, data)` of the variant of the given picture.
+        Raises an `OSError` if the picture cannot be read or decoded.
+        """
+        path = self.variants.cache_path(key, source_path, size)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None:
+                self.entries.move_to_end(path)
+                return entry
+        try:
+            data = self.read_variant(key, source_path, size, path)
+        except FileNotFoundError:
+            # evicted from the disk between its generation and its reading
+            data = self.read_variant(key, source_path, size, path)
+        # the variant's name is the hash of its key
+        entry = (os.path.splitext(os.path.basename(path))[0], data)
+        with self.lock:
+            if path not in self.entries:
+                self.entries[path] = entry
+                self.total_bytes += len(data)
+                while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                    _, (_, evicted) = self.entries.popitem(last=False)
+                    self.total_bytes -= len(evicted)
+        return entry
+
+    def read_variant(self, key, source_path, size, path):
+        self.variants.get(key, source_path, size)
+        with open(path, 'rb') as file:
+            return file.read()
+
+    def pregenerate(self, key, source_path):
+        """
+        Generates the variants of the given picture in the background.
+        """
+        for size in self.sizes:
+            self.variants.submit(key, source_path, size)
+
+
+# cache of the app, created on first use
+avatar_cache = None
+avatar_cache_lock = threading.Lock()
+
+
+def get_avatar_cache(config):
+    global avatar_cache
+    with avatar_cache_lock:
+        if avatar_cache is None:
+            os.makedirs(config['AVATAR_DIRECTORY'], exist_ok=True)
+            variants = ThumbnailCache(config['AVATAR_DIRECTORY'], config['AVATAR_DISK_CACHE_SIZE'],
+                                      config['AVATAR_QUALITY'], config['AVATAR_WORKERS'])
+            avatar_cache = AvatarCache(variants, config['AVATAR_SIZES'], config['AVATAR_MEMORY_CACHE_SIZE'])
+        return avatar_cache
+
+
+def reset_avatar_cache():
+    """
+    Forgets the cache of the parent process in a forked worker: the threads
+    generating its variants are not inherited (nor are the locks, if held),
+    so the worker creates its own.
+    """
+    global avatar_cache, avatar_cache_lock
+    avatar_cache = None
+    avatar_cache_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=reset_avatar_cache)
@@ -1,13 +1,129 @@
+import os
+import shutil
+
+from sqlalchemy import select
+
 from ..database.access import db
-from ..database.models import ImageAnnotation
+from ..database.models import BankAccess, BankFile, ImageAnnotation, ImageBank, ImageSuggestion, ImageToAnnotate, \
+  UserSelectedKeyword
+from ..database.permissions import invalidate_bank_permissions
+from ..textproc.proc import user_keyword_cache
+
+# prefix of the names of the banks being deleted by a job: bank names are
+# folder names, which cannot hold a '/', so no new bank can take them
+DELETING_BANK_PREFIX = 'deleting/'
+# number of images deleted per transaction by `delete_bank_by_chunks` (their
+# ids make an `IN (...)` clause, see `discovery.IN_CHUNK_SIZE`)
+DELETE_CHUNK_SIZE = 500
+
+
+def delete_images(image_ids):
+  """
+  Deletes the given images and the rows referring to them.
+
+  :param image_ids: a list or a `select` of the ids of the images
+  """
+  db.session.query(ImageAnnotation).filter(ImageAnnotation.image_id.in_(image_ids)) \
+    .delete(synchronize_session=False)
+  db.session.query(ImageSuggestion).filter(ImageSuggestion.image_id.in_(image_ids)) \
+    .delete(synchronize_session=False)
+  db.session.query(ImageToAnnotate).filter(ImageToAnnotate.id.in_(image_ids)) \
+    .delete(synchronize_session=False)
+
+
+def delete_bank_accesses(bank_id):
+  """
+  Deletes the accesses to a bank, which hides it from all users.
+  """
+  db.session.query(BankAccess).filter(BankAccess.bank_id == bank_id).delete(synchronize_session=False)
+
+
+def mark_bank_deleting(bank, bank_path):
+  """
+  Renames a bank to be deleted by `delete_bank_by_chunks`, and deletes its
+  accesses so that it is hidden from all users. Its folder is renamed to a
+  hidden one, ignored by the discovery, whose path is returned (`None` if
+  there is no folder). A bank of the same name uploaded or discovered
+  meanwhile is then a new one, rather than getting its images added to the
+  dying bank.
+  """
+  bank.bankname = DELETING_BANK_PREFIX + str(bank.id)
+  delete_bank_accesses(bank.id)
+  db.session.commit()
+  invalidate_bank_permissions(bank.id)
+  if not os.path.isdir(bank_path):
+    return None
+  deleting_path = deleting_bank_path(os.path.dirname(os.path.normpath(bank_path)), bank.id)
+  os.rename(bank_path, deleting_path)
+  return deleting_path
+
+
+def deleting_bank_path(banks_directory, bank_id):
+  """
+  Returns the hidden folder of a bank marked by `mark_bank_deleting`.
+  """
+  return os.path.join(banks_directory, '.deleting-' + str(bank_id))
+
+
+def is_bank_deleting(bank):
+  return bank.bankname.startswith(DELETING_BANK_PREFIX)
+
+
+def delete_bank_rows(bank_id):
+  """
+  Deletes a bank (whose images are already deleted) and the rows referring
+  to it.
+  """
+  delete_bank_accesses(bank_id)
+  db.session.query(UserSelectedKeyword).filter(UserSelectedKeyword.image_bank_id == bank_id) \
+    .delete(synchronize_session=False)
+  db.session.query(BankFile).filter(BankFile.bank_id == bank_id).delete(synchronize_session=False)
+  db.session.query(ImageBank).filter(ImageBank.id == bank_id).delete(synchronize_session=False)
+
 
 def delete_bank(bank):
-  db.session.delete(bank)
+  """
+  Deletes a bank with all its images, annotations, accesses and keywords,
+  with a few set-based DELETEs in one transaction. `bank` is detached from
+  the session, so its loaded attributes can still be read afterwards.
+  """
+  bank_id = bank.id
+  user_keyword_cache.discard(bank_id)
+  db.session.expunge(bank)
+  delete_images(select(ImageToAnnotate.id).where(ImageToAnnotate.image_bank_id == bank_id))
+  delete_bank_rows(bank_id)
+  db.session.commit()
+  invalidate_bank_permissions(bank_id)
+
+
+def delete_bank_by_chunks(bank_id, bank_path=None, progress=None):
+  """
+  Deletes a bank like `delete_bank`, but its images by chunks of
+  `DELETE_CHUNK_SIZE`, each in its own transaction, so that the database
+  is never locked for long. Meant to run as a job, on a bank marked by
+  `mark_bank_deleting`.
+
+  :param bank_path: the bank's folder, removed first if given
+  :param progress: optional `JobProgress` to report to
+  """
+  user_keyword_cache.discard(bank_id)
+  if bank_path is not None:
+    shutil.rmtree(bank_path, ignore_errors=True)
+  delete_bank_accesses(bank_id)
   db.session.commit()
-  for image in bank.images:
-    db.session.query(ImageAnnotation).filter(ImageAnnotation.image_id == image.id).delete()
+  invalidate_bank_permissions(bank_id)
+  deleted = 0
+  while True:
+    image_ids = [image.id for image in db.session.query(ImageToAnnotate.id)
+                 .filter(ImageToAnnotate.image_bank_id == bank_id)
+                 .limit(DELETE_CHUNK_SIZE)]
+    if not image_ids:
+      break
+    delete_images(image_ids)
     db.session.commit()
-    db.session.delete(image)
-  for access in bank.accesses:
-    db.session.delete(access)
+    deleted += len(image_ids)
+    if progress is not None:
+      progress.update(imagesDeleted=deleted)
+  delete_bank_rows(bank_id)
   db.session.commit()
+  return 'Deleted ' + str(deleted) + ' images'
@@ -0,0 +1,166 @@
+"""
+Binary storage of polygonal regions, more compact and faster to decode
+than the `"x,y;x,y;..."` text of `PolygonalRegion.sql_serialize_region`.
+
+Regions are handled as flat coordinate sequences `x0, y0, x1, y1, ...`.
+An encoded region is a format byte followed by:
+- `PACKED_INT16` / `PACKED_INT32`: the coordinates as little-endian
+  16/32-bit integers;
+- `DELTA_VARINT`: the first point, then the difference of each point with
+  the previous one, as zigzag-encoded variable-length integers.
+"""
+from array import array
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PACKED_INT16 = 1
+PACKED_INT32 = 2
+DELTA_VARINT = 3
+
+INT16_TYPECODE = 'h'
+# 'i' is 32 bits on all supported platforms, 'l' is the fallback
+INT32_TYPECODE = 'i' if array('i').itemsize == 4 else 'l'
+
+# values of the `REGION_STORAGE` setting
+TEXT_STORAGE = 'text'
+PACKED_STORAGE = 'packed'
+VARINT_STORAGE = 'varint'
+
+
+def text_to_coords(raw):
+    """
+    Parses the `"x,y;x,y;..."` text format into a flat coordinate array.
+    """
+    return array(INT32_TYPECODE, map(int, raw.replace(';', ',').split(',')))
+
+
+def coords_to_text(coords):
+    """
+    Formats a flat coordinate sequence in the `"x,y;x,y;..."` text format.
+    """
+    return ';'.join(f'{coords[i]},{coords[i + 1]}' for i in range(0, len(coords), 2))
+
+
+def zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def unzigzag(value):
+    return value // 2 if not value & 1 else -(value + 1) // 2
+
+
+def encode_varints(coords):
+    out = bytearray([DELTA_VARINT])
+    previous_x = previous_y = 0
+    for i in range(0, len(coords), 2):
+        x, y = coords[i], coords[i + 1]
+        for value in (zigzag(x - previous_x), zigzag(y - previous_y)):
+            while value >= 0x80:
+                out.append((value & 0x7F) | 0x80)
+                value >>= 7
+            out.append(value)
+        previous_x, previous_y = x, y
+    return bytes(out)
+
+
+def decode_varints(blob):
+    coords = array(INT32_TYPECODE)
+    value = shift = 0
+    previous = [0, 0]
+    for byte in memoryview(blob)[1:]:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        axis = len(coords) & 1
+        previous[axis] += unzigzag(value)
+        coords.append(previous[axis])
+        value = shift = 0
+    return coords
+
+
+def encode_packed(coords):
+    """
+    Packs the coordinates as 16-bit integers when they fit, else as
+    32-bit ones.
+    """
+    if all(-0x8000 <= c < 0x8000 for c in coords):
+        fmt, packed = PACKED_INT16, array(INT16_TYPECODE, coords)
+    else:
+        fmt, packed = PACKED_INT32, array(INT32_TYPECODE, coords)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return bytes([fmt]) + packed.tobytes()
+
+
+def encode_coords(coords, storage=PACKED_STORAGE):
+    """
+    Encodes a flat coordinate sequence with the given binary storage.
+    """
+    if storage == VARINT_STORAGE:
+        return encode_varints(coords)
+    return encode_packed(coords)
+
+
+def decode_coords(blob):
+    """
+    Decodes an encoded region into a flat coordinate `array`.
+    """
+    fmt = blob[0]
+    if fmt == DELTA_VARINT:
+        return decode_varints(blob)
+    typecode = INT16_TYPECODE if fmt == PACKED_INT16 else INT32_TYPECODE
+    coords = array(typecode)
+    coords.frombytes(memoryview(blob)[1:])
+    if sys.byteorder == 'big':
+        coords.byteswap()
+    return coords
+
+
+def decode_coords_numpy(blob):
+    """
+    Decodes an encoded region into a flat NumPy array. Packed regions are
+    not copied: the array is a read-only view over `blob`.
+    """
+    fmt = blob[0]
+    if fmt == PACKED_INT16:
+        return numpy.frombuffer(blob, dtype='<i2', offset=1)
+    if fmt == PACKED_INT32:
+        return numpy.frombuffer(blob, dtype='<i4', offset=1)
+    return numpy.array(decode_varints(blob), dtype='<i4')
+
+
+def region_columns(coords, storage):
+    """
+    Returns the values of the `region_info` and `region_data` columns of
+    an annotation storing the given region with the given storage.
+    """
+    if storage == TEXT_STORAGE:
+        return coords_to_text(coords), None
+    return None, encode_coords(coords, storage)
+
+
+def region_text(region_info, region_data):
+    """
+    Returns the text format of a region stored in either column, as served
+    by the API.
+    """
+    if region_info is not None or region_data is None:
+        return region_info
+    return coords_to_text(decode_coords(region_data))
+
+
+def region_coords(region_info, region_data):
+    """
+    Returns the flat coordinates of a region stored in either column (a
+    NumPy array for the binary column, when NumPy is available).
+    """
+    if region_info is not None or region_data is None:
+        return text_to_coords(region_info)
+    if numpy is not None:
+        return decode_coords_numpy(region_data)
+    return decode_coords(region_data)
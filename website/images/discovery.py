@@ -1,110 +1,340 @@
 import os
 import glob
-from pathlib import Path
+import struct
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, where the app runs in a single process
+    fcntl = None
+from concurrent.futures import ThreadPoolExecutor
 
-from website.images.banks import delete_bank
-from ..database.models import ImageBank, ImageToAnnotate, BankAccess, User
+from flask import current_app
+
+from website.images.banks import delete_bank, delete_bank_by_chunks, deleting_bank_path, is_bank_deleting
+from ..database.models import ImageBank, ImageToAnnotate, BankAccess, BankFile, User, ImageSuggestion
 from ..database.access import db
+from ..database.permissions import invalidate_user_permissions
+from ..textproc.precompute import precompute_bank_suggestions
+from .thumbnails import pregenerate_thumbnails
 from PIL import Image
 
 base_directory = os.getcwd()
 default_bank_directory = base_directory + os.sep + 'banks'
 BANK_DESCRIPTION_FILE = 'description.txt'
+DISCOVERY_LOCK_FILE = os.path.join(base_directory, 'discovery.lock')
+# maximal number of values in a single `IN (...)` clause
+IN_CHUNK_SIZE = 500
+# number of new images probed and inserted at once
+INSERT_CHUNK_SIZE = 500
+# JPEG start-of-frame markers (0xC4, 0xC8 and 0xCC are not frames)
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# JPEG markers that are not followed by a segment length
+JPEG_STANDALONE_MARKERS = set(range(0xD0, 0xD9)) | {0x01}
+
+
+def read_jpeg_dimensions(path):
+    """
+    Returns the `(width, height)` of a JPEG file by only reading its
+    segment headers up to the first start-of-frame, or `None` if that
+    frame could not be found.
+    """
+    with open(path, 'rb') as file:
+        if file.read(2) != b'\xff\xd8':
+            return None
+        try:
+            while True:
+                byte = file.read(1)
+                # skip anything up to the next marker, and its fill bytes
+                while byte and byte != b'\xff':
+                    byte = file.read(1)
+                while byte == b'\xff':
+                    byte = file.read(1)
+                if not byte:
+                    return None
+                marker = byte[0]
+                if marker in JPEG_STANDALONE_MARKERS:
+                    continue
+                if marker == 0xD9 or marker == 0xDA:
+                    # end of image or start of scan: no frame header
+                    return None
+                length, = struct.unpack('>H', file.read(2))
+                if marker in JPEG_SOF_MARKERS:
+                    _, height, width = struct.unpack('>BHH', file.read(5))
+                    # a zero height is defined later in the scan
+                    return (width, height) if width and height else None
+                file.seek(length - 2, os.SEEK_CUR)
+        except struct.error:
+            # truncated file
+            return None
+
 
 def get_dimensions(path):
+    dimensions = read_jpeg_dimensions(path)
+    if dimensions is not None:
+        return dimensions
     img_file = Image.open(path)
     return img_file.size
 
 
-def discover_all_banks():
+def get_all_dimensions(paths):
+    """
+    Returns the dimensions of the given images, probed in parallel.
+    """
+    if len(paths) < 2:
+        return [get_dimensions(path) for path in paths]
+    with ThreadPoolExecutor(max_workers=current_app.config['DIMENSION_PROBE_WORKERS']) as pool:
+        return list(pool.map(get_dimensions, paths))
+
+
+def in_chunks(values):
+    """
+    Splits `values` in lists that fit in an `IN (...)` clause.
+    """
+    values = list(values)
+    return [values[i:i + IN_CHUNK_SIZE] for i in range(0, len(values), IN_CHUNK_SIZE)]
+
+
+# file held by the process in charge of discovering the banks
+discovery_lock = None
+
+
+def acquire_discovery_lock():
+    """
+    Returns `True` iff this process is (or has become) the one in charge of
+    discovering the banks. The lock is held until the process exits, so
+    that among workers started together only one scans the banks.
+    """
+    global discovery_lock
+    if discovery_lock is not None or fcntl is None:
+        return True
+    file = open(DISCOVERY_LOCK_FILE, 'a')
+    try:
+        fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        # another worker discovers the banks
+        file.close()
+        return False
+    discovery_lock = file
+    return True
+
+
+def discover_all_banks(progress=None):
+    """
+    Synchronizes the database with all the banks' folders.
+
+    :param progress: optional `JobProgress` to report to
+    """
     if not os.path.isdir(default_bank_directory):
         os.mkdir(default_bank_directory)
     bank_list = glob.glob(default_bank_directory + os.sep + '*' + os.sep)
-    for bank in bank_list:
+    incremental = current_app.config['INCREMENTAL_DISCOVERY']
+    for i, bank in enumerate(bank_list):
+        if progress is not None:
+            progress.update(banks=len(bank_list), banksDone=i)
         print('> discovering bank ' + bank)
-        discover_bank(bank)
+        discovered, _ = discover_bank(bank, incremental=incremental, progress=progress)
+        if discovered is not None and current_app.config['PRECOMPUTE_SUGGESTIONS']:
+            print('>> precomputed suggestions of ' + str(precompute_bank_suggestions(discovered.id)) + ' images')
+    if progress is not None:
+        progress.update(banks=len(bank_list), banksDone=len(bank_list))
     # now, delete banks that were removed by the user
-    bank_names = [os.path.basename(os.path.normpath(bank_path)) for bank_path in bank_list]
+    bank_names = {os.path.basename(os.path.normpath(bank_path)) for bank_path in bank_list}
     for bank in db.session.query(ImageBank).all():
-        if bank.bankname not in bank_names:
+        if is_bank_deleting(bank):
+            # its deletion job was interrupted (or still runs: deleting the
+            # same rows twice is harmless)
+            print('> finishing the deletion of bank ' + str(bank.id))
+            delete_bank_by_chunks(bank.id, deleting_bank_path(default_bank_directory, bank.id))
+        elif bank.bankname not in bank_names:
             delete_bank(bank)
             print('> bank ' + bank.bankname + ' has been removed; deleted its entries in the database')
+    return 'Discovered ' + str(len(bank_list)) + ' banks'
 
 
-def discover_bank(bank_path):
-    # first, get bank's description
-    bank_description = ''
+def scan_bank_folder(bank_path):
+    """
+    Returns the `{file name: (mtime, size)}` stats of the images and text
+    files of a bank's folder, without opening them.
+    """
+    stats = {}
+    with os.scandir(bank_path) as entries:
+        for entry in entries:
+            # like `glob`, ignore hidden images
+            is_image = entry.name.endswith('.jpg') and not entry.name.startswith('.')
+            if (is_image or entry.name.endswith('.txt')) and entry.is_file():
+                stat = entry.stat()
+                stats[entry.name] = (stat.st_mtime_ns, stat.st_size)
+    return stats
+
+
+def update_manifest(bank_id, stats, known, changed):
+    """
+    Brings the stored manifest of a bank (`known`) up to date with the
+    stats of its folder.
+    """
+    outdated = (changed | (known.keys() - stats.keys())) & known.keys()
+    for chunk in in_chunks(outdated):
+        db.session.query(BankFile) \
+            .filter(BankFile.bank_id == bank_id, BankFile.path.in_(chunk)) \
+            .delete(synchronize_session=False)
+    if changed:
+        db.session.execute(BankFile.__table__.insert(), [
+            {'bank_id': bank_id, 'path': name, 'mtime': stats[name][0], 'size': stats[name][1]}
+            for name in changed
+        ])
+
+
+def insert_images(bank_id, bank_path, images, urls, read_description, progress=None):
+    """
+    Probes the dimensions of the given new images and inserts them, by
+    chunks of `INSERT_CHUNK_SIZE` (generating their thumbnails first, if
+    enabled).
+
+    :param progress: optional `JobProgress` to report to
+    """
+    for start in range(0, len(urls), INSERT_CHUNK_SIZE):
+        chunk = urls[start:start + INSERT_CHUNK_SIZE]
+        dimensions = get_all_dimensions([os.path.join(bank_path, images[url][0]) for url in chunk])
+        if progress is not None:
+            progress.update(images=len(urls), imagesProbed=start + len(chunk))
+        if current_app.config['PREGENERATE_THUMBNAILS']:
+            count = pregenerate_thumbnails(current_app.config, bank_path, [(url, images[url][0]) for url in chunk])
+            print('>> generated ' + str(count) + ' thumbnails')
+        db.session.execute(ImageToAnnotate.__table__.insert(), [
+            {
+                'image_bank_id': bank_id,
+                'file_url': url,
+                'description': read_description(images[url][1]),
+                'width': width,
+                'height': height,
+            } for url, (width, height) in zip(chunk, dimensions)
+        ])
+        if progress is not None:
+            progress.update(rowsInserted=start + len(chunk))
+
+
+def discover_bank(bank_path, incremental=True, progress=None):
+    """
+    Synchronizes the database with the content of a bank's folder.
+
+    :param incremental: only read the files whose stat changed since the
+        last discovery of the bank (otherwise, re-read the whole folder)
+    :param progress: optional `JobProgress` to report to
+    """
     bank_name = os.path.basename(os.path.normpath(bank_path))
     existing_bank = db.session.query(ImageBank).filter(ImageBank.bankname == bank_name).first()
-    desc_file_path = os.path.join(bank_path, BANK_DESCRIPTION_FILE)
+    stats = scan_bank_folder(bank_path)
+    known = {}
+    if existing_bank is not None:
+        known = {
+            f.path: (f.mtime, f.size) for f in db.session.query(BankFile.path, BankFile.mtime, BankFile.size)
+            .filter(BankFile.bank_id == existing_bank.id)
+        }
+    if not incremental:
+        # forget the manifest: everything gets read again
+        changed = set(stats.keys())
+        modified = set()
+    else:
+        changed = {name for name, stat in stats.items() if known.get(name) != stat}
+        # files already seen by an earlier discovery, that changed since
+        modified = changed & known.keys()
+    # first, get bank's description
+    bank_description = ''
     # if has description file
-    if os.path.isfile(desc_file_path):
-        with open(desc_file_path, 'r') as file:
+    if BANK_DESCRIPTION_FILE in stats and (existing_bank is None or BANK_DESCRIPTION_FILE in changed):
+        with open(os.path.join(bank_path, BANK_DESCRIPTION_FILE), 'r') as file:
             bank_description = file.read().replace('\n', '')
         if existing_bank is not None and bank_description != existing_bank.description:
             existing_bank.description = bank_description
             db.session.commit()
             print('>> updated description of ' + bank_name)
-    # list images
-    all_images = glob.glob(bank_path + '/*.jpg')
-    all_pairs = []
-    for image in all_images:
+    # list images, as {relative location to the banks/ folder: (image file, description file)}
+    images = {}
+    for name in stats:
+        if not name.endswith('.jpg'):
+            continue
         # find matching description
-        name_no_ext = Path(image).stem
-        splits = name_no_ext.split('_')
+        splits = name[:-len('.jpg')].split('_')
         if len(splits) > 2:
             # ignore masks, for now
             continue
-        data_description_file = os.path.join(bank_path, splits[0] + '.txt')
-        if not os.path.isfile(data_description_file):
-            print('!> could not find a description for image ' + name_no_ext + '.jpg (skipping image)')
+        data_description_file = splits[0] + '.txt'
+        if data_description_file not in stats:
+            print('!> could not find a description for image ' + name + ' (skipping image)')
             # no description available! skip
             continue
-        # matching description found, read it, and add it to list
-        txt_description = ''
-        with open(data_description_file, 'r') as file:
-            txt_description = file.read()
-        all_pairs.append({
-            'path': os.path.join(bank_path, name_no_ext + '.jpg'),
-            'name': bank_name + '/' + name_no_ext + '.jpg', # the file's relative location to the banks/ folder
-            'description': txt_description.split('\n')[3], # the fourth line contains the description
-        })
-    print('>> found ' + str(len(all_images)) + ' image(s)')
+        images[bank_name + '/' + name] = (name, data_description_file)
+    print('>> found ' + str(len(images)) + ' image(s)')
+    # description files are read at most once, and only when needed
+    descriptions = {}
+
+    def read_description(data_description_file):
+        if data_description_file not in descriptions:
+            with open(os.path.join(bank_path, data_description_file), 'r') as file:
+                # the fourth line contains the description
+                descriptions[data_description_file] = file.read().split('\n')[3]
+        return descriptions[data_description_file]
+
     # now that we have all images, push them to the database
     if existing_bank is None:
-        if not all_pairs:
+        if not images:
             return None, 'No valid content found'
         # create the bank
         bank = ImageBank(bank_name, bank_description)
         db.session.add(bank)
         db.session.commit()
         # if the bank did not exist, then just add all images
-        for pair in all_pairs:
-            width, height = get_dimensions(pair['path'])
-            img = ImageToAnnotate(bank.id, pair['name'], pair['description'], width, height)
-            db.session.add(img)
+        insert_images(bank.id, bank_path, images, sorted(images), read_description, progress=progress)
+        update_manifest(bank.id, stats, {}, set(stats.keys()))
         db.session.commit()
-        # + give access to admin by default 
+        # + give access to admin by default
         admin = db.session.query(User).filter(User.username == 'admin').first()
         db.session.add(BankAccess(admin.id, bank.id, 100))
         db.session.commit()
-        return bank, 'Found ' + str(len(all_pairs)) + ' images'
-    else:
-        # first, delete images that have been removed
-        urls = [image['name'] for image in all_pairs]
-        delete = [image for image in existing_bank.images if image.file_url not in urls]
-        for d in delete:
-            db.session.query(ImageToAnnotate).filter(ImageToAnnotate.file_url == d.file_url).delete()
-        if delete:
-            db.session.commit()
-            print('>> deleted ' + str(len(delete)) + ' images')
-        # now, add newer images
-        existing_urls = [image.file_url for image in existing_bank.images]
-        add = [image for image in all_pairs if image['name'] not in existing_urls]
-        for a in add:
-            width, height = get_dimensions(a['path'])
-            db.session.add(ImageToAnnotate(existing_bank.id, a['name'], a['description'], width, height))
-        if add:
-            db.session.commit()
-            print('>> added ' + str(len(add)) + ' images')
-        return existing_bank, 'Found ' + str(len(all_pairs)) + ' images'
+        invalidate_user_permissions(admin.id)
+        return bank, 'Found ' + str(len(images)) + ' images'
+    existing = dict(db.session.query(ImageToAnnotate.file_url, ImageToAnnotate.id)
+                    .filter(ImageToAnnotate.image_bank_id == existing_bank.id))
+    # first, delete images that have been removed
+    delete = [existing[url] for url in existing.keys() - images.keys()]
+    for chunk in in_chunks(delete):
+        db.session.query(ImageSuggestion).filter(ImageSuggestion.image_id.in_(chunk)) \
+            .delete(synchronize_session=False)
+        db.session.query(ImageToAnnotate).filter(ImageToAnnotate.id.in_(chunk)) \
+            .delete(synchronize_session=False)
+    if delete:
+        db.session.commit()
+        print('>> deleted ' + str(len(delete)) + ' images')
+    # then, re-read the files of the known images that changed on disk
+    updated = 0
+    kept = sorted(images.keys() & existing.keys())
+    resized = [url for url in kept if images[url][0] in modified]
+    dimensions = get_all_dimensions([os.path.join(bank_path, images[url][0]) for url in resized])
+    for url, (width, height) in zip(resized, dimensions):
+        db.session.query(ImageToAnnotate).filter(ImageToAnnotate.id == existing[url]) \
+            .update({ImageToAnnotate.width: width, ImageToAnnotate.height: height},
+                    synchronize_session=False)
+        updated += 1
+    for url in kept:
+        name, data_description_file = images[url]
+        image_id = existing[url]
+        if data_description_file in modified:
+            # annotations refer to the text by offsets: only update images without any
+            count = db.session.query(ImageToAnnotate) \
+                .filter(ImageToAnnotate.id == image_id, ~ImageToAnnotate.annotations.any()) \
+                .update({ImageToAnnotate.description: read_description(data_description_file)},
+                        synchronize_session=False)
+            if count:
+                db.session.query(ImageSuggestion).filter(ImageSuggestion.image_id == image_id) \
+                    .delete(synchronize_session=False)
+                updated += 1
+    if updated:
+        print('>> updated ' + str(updated) + ' images')
+    # now, add newer images
+    add = sorted(images.keys() - existing.keys())
+    insert_images(existing_bank.id, bank_path, images, add, read_description, progress=progress)
+    if add:
+        print('>> added ' + str(len(add)) + ' images')
+    update_manifest(existing_bank.id, stats, known, changed)
+    db.session.commit()
+    return existing_bank, 'Found ' + str(len(images)) + ' images'
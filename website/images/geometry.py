@@ -1,10 +1,20 @@
 from abc import abstractmethod
+from array import array
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .codec import coords_to_text, text_to_coords
 
 
 class Point:
     """
     Represents a 2D point.
     """
+    __slots__ = ('x', 'y')
 
     def __init__(self, x, y):
         """
@@ -29,6 +39,78 @@ class Point:
         return Point(int(pred[0]), int(pred[1]))
 
 
+def to_coord_array(values):
+    """
+    Returns the given flat coordinates as a contiguous array: a NumPy array
+    when NumPy is available, an `array` of integers (or of floats, if some
+    coordinates are not integers) otherwise. Raises a `ValueError` if some
+    coordinates are not finite numbers.
+    """
+    if numpy is not None:
+        coord_array = numpy.asarray(values)
+        if coord_array.dtype.kind not in 'iuf':
+            raise ValueError('coordinates must be numbers')
+        if coord_array.dtype.kind == 'f' and not numpy.isfinite(coord_array).all():
+            raise ValueError('coordinates must be finite')
+        return coord_array
+    types = set(map(type, values))
+    if types <= {int}:
+        return array('i', values)
+    if types <= {int, float}:
+        if not all(map(math.isfinite, values)):
+            raise ValueError('coordinates must be finite')
+        return array('d', values)
+    raise ValueError('coordinates must be numbers')
+
+
+def segment_distances(xs, ys, start, end):
+    """
+    Returns the distances of the points `start + 1` to `end - 1` to the
+    segment between the points `start` and `end`.
+    """
+    ax, ay, bx, by = xs[start], ys[start], xs[end], ys[end]
+    dx, dy = bx - ax, by - ay
+    length = (dx * dx + dy * dy) ** 0.5
+    if length == 0:
+        return [((xs[i] - ax) ** 2 + (ys[i] - ay) ** 2) ** 0.5 for i in range(start + 1, end)]
+    return [abs(dy * (xs[i] - ax) - dx * (ys[i] - ay)) / length for i in range(start + 1, end)]
+
+
+def simplify_ring_numpy(xs, ys, tolerance):
+    """
+    Returns the mask of the points of the closed ring `xs`, `ys` (whose last
+    point is its first one) kept by Ramer-Douglas-Peucker. The segments are
+    split level by level: each level computes the distances of all the
+    pending points to their segments at once.
+    """
+    keep = numpy.zeros(len(xs), dtype=bool)
+    keep[0] = keep[-1] = True
+    # points of the segments that remain to split
+    pending = ~keep
+    while pending.any():
+        kept = numpy.flatnonzero(keep)
+        points = numpy.flatnonzero(pending)
+        # the segment of each point, by the index of its start in `kept`
+        segments = numpy.searchsorted(kept, points) - 1
+        ax, ay = xs[kept[segments]], ys[kept[segments]]
+        dx, dy = xs[kept[segments + 1]] - ax, ys[kept[segments + 1]] - ay
+        px, py = xs[points] - ax, ys[points] - ay
+        length = numpy.hypot(dx, dy)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            distances = numpy.where(length == 0, numpy.hypot(px, py), numpy.abs(dy * px - dx * py) / length)
+        # the farthest point of each segment (the first one, on ties) comes first
+        order = numpy.lexsort((-distances, segments))
+        first = numpy.ones(len(order), dtype=bool)
+        first[1:] = segments[order][1:] != segments[order][:-1]
+        farthest = order[first]
+        splitting = farthest[distances[farthest] > tolerance]
+        keep[points[splitting]] = True
+        # the points of the segments within tolerance are removed
+        pending[points[~numpy.isin(segments, segments[splitting])]] = False
+        pending[points[splitting]] = False
+    return keep
+
+
 class ImageRegion:
     """
     Represents annotations on an image region described by a tag.
@@ -53,6 +135,10 @@ class PolygonalRegion(ImageRegion):
     An implementation of `ImageRegion` for polygonal regions.
 
     Use `RectangularAnnotation` for rectangular regions.
+
+    The vertices are kept as one contiguous `[x0, y0, x1, y1, ...]` array,
+    so that the computations on the polygon run over arrays rather than
+    over `Point` objects.
     """
 
     def __init__(self, points):
@@ -63,11 +149,162 @@ class PolygonalRegion(ImageRegion):
         super().__init__()
         # allow 2 points for rectangles
         assert points is not None and len(points) > 1
-        self.points = points
+        self.coord_array = to_coord_array([c for point in points for c in (point.x, point.y)])
+
+    @property
+    def points(self):
+        """
+        The vertices of the polygon, as `Point` objects.
+        """
+        xs, ys = self.xs(), self.ys()
+        return [Point(xs[i], ys[i]) for i in range(len(xs))]
+
+    def xs(self):
+        return self.coord_array[0::2]
+
+    def ys(self):
+        return self.coord_array[1::2]
+
+    def coords(self):
+        """
+        Returns the flat `[x0, y0, x1, y1, ...]` integer coordinates of the
+        polygon, as stored by `images.codec`.
+        """
+        if numpy is not None:
+            return self.coord_array.astype(int).tolist()
+        return [int(c) for c in self.coord_array]
+
+    def bounds(self):
+        """
+        Returns the bounding box of the polygon, as
+        `(min_x, min_y, max_x, max_y)`.
+        """
+        xs, ys = self.xs(), self.ys()
+        if numpy is not None:
+            return xs.min(), ys.min(), xs.max(), ys.max()
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def within(self, width, height):
+        """
+        Returns `True` iff all the vertices lie in the `width` x `height`
+        rectangle with the origin as corner.
+        """
+        min_x, min_y, max_x, max_y = self.bounds()
+        return min_x >= 0 and min_y >= 0 and max_x <= width and max_y <= height
+
+    def intersects_box(self, min_x, min_y, max_x, max_y):
+        """
+        Returns `True` iff the polygon and the given box overlap: an edge of
+        the polygon crosses the box, or the box lies inside the polygon.
+        """
+        xs, ys = self.xs(), self.ys()
+        corners = ((min_x, min_y), (max_x, min_y), (max_x, max_y), (min_x, max_y))
+        if numpy is not None:
+            ax, ay = xs.astype(float), ys.astype(float)
+            bx, by = numpy.roll(ax, -1), numpy.roll(ay, -1)
+            # the edges whose bounding box overlaps the box...
+            near = (numpy.minimum(ax, bx) <= max_x) & (numpy.maximum(ax, bx) >= min_x) \
+                & (numpy.minimum(ay, by) <= max_y) & (numpy.maximum(ay, by) >= min_y)
+            # ...cross it iff the box's corners are not all on the same side of them
+            sides = numpy.array([(bx - ax) * (cy - ay) - (by - ay) * (cx - ax) for cx, cy in corners])
+            crossing = near & (sides.min(axis=0) <= 0) & (sides.max(axis=0) >= 0)
+            if crossing.any():
+                return True
+        else:
+            n = len(xs)
+            for i in range(n):
+                ax, ay, bx, by = xs[i], ys[i], xs[(i + 1) % n], ys[(i + 1) % n]
+                if min(ax, bx) > max_x or max(ax, bx) < min_x or min(ay, by) > max_y or max(ay, by) < min_y:
+                    continue
+                sides = [(bx - ax) * (cy - ay) - (by - ay) * (cx - ax) for cx, cy in corners]
+                if min(sides) <= 0 <= max(sides):
+                    return True
+        return self.contains(min_x, min_y)
+
+    def area(self):
+        """
+        Returns the area of the polygon (shoelace formula).
+        """
+        xs, ys = self.xs(), self.ys()
+        if numpy is not None:
+            xs, ys = xs.astype(float), ys.astype(float)
+            return abs(float(numpy.dot(xs, numpy.roll(ys, -1)) - numpy.dot(ys, numpy.roll(xs, -1)))) / 2
+        n = len(xs)
+        return abs(sum(xs[i] * ys[(i + 1) % n] - xs[(i + 1) % n] * ys[i] for i in range(n))) / 2
+
+    def contains(self, x, y):
+        """
+        Returns `True` iff the point `(x, y)` lies inside the polygon
+        (even-odd rule; points on the edges may be on either side).
+        """
+        xs, ys = self.xs(), self.ys()
+        if numpy is not None:
+            xs, ys = xs.astype(float), ys.astype(float)
+            previous_xs, previous_ys = numpy.roll(xs, 1), numpy.roll(ys, 1)
+            straddling = (ys > y) != (previous_ys > y)
+            # the division is only relevant (and defined) for straddling edges
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                crossing_x = (previous_xs - xs) * (y - ys) / (previous_ys - ys) + xs
+            return bool(numpy.count_nonzero(straddling & (x < crossing_x)) % 2)
+        inside = False
+        j = len(xs) - 1
+        for i in range(len(xs)):
+            if (ys[i] > y) != (ys[j] > y) and x < (xs[j] - xs[i]) * (y - ys[i]) / (ys[j] - ys[i]) + xs[i]:
+                inside = not inside
+            j = i
+        return inside
+
+    def simplify(self, tolerance):
+        """
+        Returns a simplified copy of the polygon, whose vertices are a subset
+        of this polygon's ones and whose edges are at most `tolerance` away
+        from the removed vertices (Ramer-Douglas-Peucker, see
+        `simplify_ring_numpy`). A polygon that would keep fewer than three
+        vertices is left as is.
+        """
+        n = len(self.xs())
+        if numpy is not None:
+            # close the ring, so that the first vertex is treated like the others
+            xs = numpy.append(self.xs(), self.xs()[0]).astype(float)
+            ys = numpy.append(self.ys(), self.ys()[0]).astype(float)
+            keep = simplify_ring_numpy(xs, ys, tolerance)
+        else:
+            xs, ys = list(self.xs()) + [self.xs()[0]], list(self.ys()) + [self.ys()[0]]
+            keep = [False] * (n + 1)
+            keep[0] = keep[n] = True
+            pending = [(0, n)]
+            while pending:
+                start, end = pending.pop()
+                if end - start < 2:
+                    continue
+                distances = segment_distances(xs, ys, start, end)
+                farthest = max(range(len(distances)), key=distances.__getitem__)
+                if distances[farthest] > tolerance:
+                    keep[start + 1 + farthest] = True
+                    pending.append((start, start + 1 + farthest))
+                    pending.append((start + 1 + farthest, end))
+        if sum(keep[:n]) < 3:
+            return PolygonalRegion.from_coords(list(self.coord_array))
+        if numpy is not None:
+            return PolygonalRegion.from_coords(self.coord_array.reshape(-1, 2)[keep[:n]].ravel())
+        return PolygonalRegion.from_coords([c for i in range(n) if keep[i]
+                                            for c in (self.xs()[i], self.ys()[i])])
 
     def sql_serialize_region(self):
-        raw = [f'{point.sql_serialize()}' for point in self.points]
-        return ';'.join(raw)
+        return coords_to_text(self.coords())
+
+    @staticmethod
+    def from_coords(coords):
+        """
+        Builds a `PolygonalRegion` from flat `[x0, y0, x1, y1, ...]`
+        coordinates.
+        """
+        # allow 2 points for rectangles
+        assert len(coords) > 3 and len(coords) % 2 == 0
+        region = PolygonalRegion.__new__(PolygonalRegion)
+        ImageRegion.__init__(region)
+        region.coord_array = to_coord_array(coords)
+        return region
 
     @staticmethod
     def deserialize_from_sql(sql):
@@ -76,9 +313,7 @@ class PolygonalRegion(ImageRegion):
 
         :param sql: the raw serialization text
         """
-        parts = sql.split(';')
-        new_points = [Point.deserialize(part) for part in parts]
-        return PolygonalRegion(new_points)
+        return PolygonalRegion.from_coords(text_to_coords(sql))
 
     @staticmethod
     def deserialize_from_json(raw):
@@ -87,4 +322,4 @@ class PolygonalRegion(ImageRegion):
 
         :param raw: the raw JSON array of input points
         """
-        return PolygonalRegion([Point(p['x'], p['y']) for p in raw])
+        return PolygonalRegion.from_coords([c for p in raw for c in (p['x'], p['y'])])
@@ -0,0 +1,171 @@
+"""
+Downscaled variants of the bank images, generated on demand (or when a bank
+is discovered) and kept in a size-bounded disk cache.
+
+A variant is keyed by the image's file URL and stat, and by the size and
+quality it is generated with, so that modified images get new variants.
+When the cache exceeds `THUMBNAIL_CACHE_SIZE` bytes, the least recently
+used variants (by access time, set explicitly on each hit) are removed.
+Their modification time is left untouched, as it makes their ETag.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
+import os
+import threading
+import time
+
+from PIL import Image
+
+# the cache is brought down to this fraction of its size when evicting
+EVICTION_TARGET = 0.9
+
+
+class ThumbnailCache:
+    """
+    Generates and stores the variants of the images in a folder, with a
+    pool of threads (PIL releases the GIL while decoding and resizing).
+    """
+
+    def __init__(self, directory, max_bytes, quality, workers):
+        """
+        :param directory: folder of the cached variants
+        :param max_bytes: maximal total size of the cached variants
+        :param quality: JPEG quality of the variants
+        :param workers: number of generating threads
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnail')
+        # reentrant: a done callback may run in the thread that registers it
+        self.lock = threading.RLock()
+        # variants being generated, by cache path
+        self.pending = {}
+        self.total_bytes = None
+
+    def cache_path(self, file_url, source_path, size):
+        stat = os.stat(source_path)
+        key = f'{file_url}:{stat.st_mtime_ns}:{stat.st_size}:{size}:{self.quality}'
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.jpg')
+
+    def generate(self, source_path, size, path):
+        """
+        Writes the variant of `source_path` fitting in a `size` x `size`
+        square to `path`.
+        """
+        with Image.open(source_path) as image:
+            # let the JPEG decoder downscale while decoding
+            image.draft('RGB', (size, size))
+            image = image.convert('RGB')
+            image.thumbnail((size, size), Image.LANCZOS)
+            # written aside then renamed, so that readers never see a partial file
+            temporary_path = f'{path}.{threading.get_ident()}.tmp'
+            image.save(temporary_path, 'JPEG', quality=self.quality, optimize=True)
+        os.replace(temporary_path, path)
+        self.added(os.path.getsize(path))
+        return path
+
+    def submit(self, file_url, source_path, size):
+        """
+        Returns a future of the path of the variant, generating it in the pool
+        unless it is cached already.
+        """
+        path = self.cache_path(file_url, source_path, size)
+        with self.lock:
+            future = self.pending.get(path)
+            if future is not None:
+                return future
+            try:
+                # refresh the variant's position in the LRU order
+                os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+                future = Future()
+                future.set_result(path)
+            except FileNotFoundError:
+                future = self.pool.submit(self.generate, source_path, size, path)
+                self.pending[path] = future
+                future.add_done_callback(lambda _: self.done(path))
+            return future
+
+    def get(self, file_url, source_path, size):
+        """
+        Returns the path of the variant of the given image, generating it if
+        needed.
+        """
+        return self.submit(file_url, source_path, size).result()
+
+    def done(self, path):
+        with self.lock:
+            self.pending.pop(path, None)
+
+    def added(self, size):
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = sum(entry.stat().st_size for entry in os.scandir(self.directory)
+                                       if entry.name.endswith('.jpg'))
+            else:
+                self.total_bytes += size
+            if self.total_bytes <= self.max_bytes:
+                return
+            self.total_bytes = self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used variants until the cache is back
+        under its target size, and returns its new size.
+        """
+        entries = [(stat.st_atime_ns, stat.st_size, entry.path) for entry, stat in
+                   ((entry, entry.stat()) for entry in os.scandir(self.directory) if entry.name.endswith('.jpg'))]
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes * EVICTION_TARGET:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # removed by another worker
+                pass
+            total -= size
+        return total
+
+
+# cache of the app, created on first use
+thumbnail_cache = None
+thumbnail_cache_lock = threading.Lock()
+
+
+def get_thumbnail_cache(config):
+    global thumbnail_cache
+    with thumbnail_cache_lock:
+        if thumbnail_cache is None:
+            os.makedirs(config['THUMBNAIL_DIRECTORY'], exist_ok=True)
+            thumbnail_cache = ThumbnailCache(config['THUMBNAIL_DIRECTORY'], config['THUMBNAIL_CACHE_SIZE'],
+                                             config['THUMBNAIL_QUALITY'], config['THUMBNAIL_WORKERS'])
+        return thumbnail_cache
+
+
+def reset_thumbnail_cache():
+    """
+    Forgets the cache of the parent process in a forked worker: the threads
+    of its pool are not inherited, so the worker creates its own.
+    """
+    global thumbnail_cache, thumbnail_cache_lock
+    thumbnail_cache = None
+    thumbnail_cache_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=reset_thumbnail_cache)
+
+
+def pregenerate_thumbnails(config, bank_path, images):
+    """
+    Generates the variants of the given images of a bank, in all sizes.
+
+    :param images: `(file URL, file name)` pairs
+    """
+    cache = get_thumbnail_cache(config)
+    futures = [cache.submit(file_url, os.path.join(bank_path, name), size)
+               for file_url, name in images for size in config['THUMBNAIL_SIZES']]
+    for future in futures:
+        future.result()
+    return len(futures)
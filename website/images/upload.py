@@ -0,0 +1,120 @@
+"""
+Ingestion of the banks uploaded as zip archives: the archive is extracted
+entry by entry within size limits, then the bank is discovered, in a
+background job.
+"""
+import os
+import shutil
+import zipfile
+
+from flask import current_app
+
+from ..database.access import db
+from ..database.models import BankAccess
+from ..database.permissions import invalidate_user_permissions
+from ..jobs import JobFailed
+from ..textproc.precompute import precompute_bank_suggestions
+from .discovery import discover_bank
+
+# size of the chunks in which archives are written and extracted
+COPY_CHUNK_SIZE = 1024 * 1024
+# extraction progress is reported every this many files
+PROGRESS_INTERVAL = 100
+# the only files of an archive used by the discovery of a bank
+BANK_FILE_EXTENSIONS = ('.jpg', '.txt')
+
+
+def save_archive(stream, location):
+    """
+    Writes an uploaded archive to `location` by chunks.
+    """
+    with open(location, 'wb') as file:
+        while True:
+            chunk = stream.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            file.write(chunk)
+
+
+def bank_entries(archive, bank_name):
+    """
+    Returns the `(entry, file name)` pairs of the bank files of an archive:
+    the images and text files at its root or in its `bank_name` folder.
+    """
+    entries = []
+    for entry in archive.infolist():
+        if entry.is_dir():
+            continue
+        *folders, name = entry.filename.split('/')
+        if folders not in ([], [bank_name]) or name.startswith('.') \
+                or not name.endswith(BANK_FILE_EXTENSIONS):
+            continue
+        entries.append((entry, name))
+    return entries
+
+
+def extract_bank_archive(location, bank_path, progress=None):
+    """
+    Extracts the bank files of the archive at `location` into `bank_path`,
+    one entry at a time. Fails if the archive holds more than
+    `MAX_BANK_FILES` of them or if they exceed `MAX_BANK_SIZE` bytes once
+    extracted (whatever sizes the archive declares).
+
+    :param progress: optional `JobProgress` to report to
+    """
+    max_files = current_app.config['MAX_BANK_FILES']
+    remaining_bytes = current_app.config['MAX_BANK_SIZE']
+    bank_name = os.path.basename(os.path.normpath(bank_path))
+    try:
+        with zipfile.ZipFile(location, 'r') as archive:
+            entries = bank_entries(archive, bank_name)
+            if len(entries) > max_files:
+                raise JobFailed(f'the archive holds more than {max_files} files')
+            for i, (entry, name) in enumerate(entries):
+                if progress is not None and i % PROGRESS_INTERVAL == 0:
+                    progress.update(files=len(entries), filesExtracted=i)
+                with archive.open(entry) as source, open(os.path.join(bank_path, name), 'wb') as target:
+                    while True:
+                        chunk = source.read(COPY_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        remaining_bytes -= len(chunk)
+                        if remaining_bytes < 0:
+                            raise JobFailed('the extracted bank exceeds the maximal size')
+                        target.write(chunk)
+            if progress is not None:
+                progress.update(files=len(entries), filesExtracted=len(entries))
+    except zipfile.BadZipFile:
+        raise JobFailed('provided bank is not a valid zip archive')
+
+
+def ingest_bank(location, bank_path, user_id, permission_level, progress=None):
+    """
+    Extracts an uploaded bank archive, discovers the bank and gives the
+    uploading user access to it. The archive is removed, and so is the
+    bank's folder if the bank could not be added.
+
+    :param user_id: the uploading user, or `None` if it already has access
+        (the super user)
+    :param permission_level: the access level given to the uploading user
+    :param progress: optional `JobProgress` to report to
+    """
+    try:
+        extract_bank_archive(location, bank_path, progress=progress)
+        new_bank, message = discover_bank(bank_path, progress=progress)
+    except Exception:
+        shutil.rmtree(bank_path, ignore_errors=True)
+        raise
+    finally:
+        os.remove(location)
+    # could not add bank (eg nothing inside)
+    if new_bank is None:
+        shutil.rmtree(bank_path)
+        raise JobFailed(message)
+    if current_app.config['PRECOMPUTE_SUGGESTIONS']:
+        precompute_bank_suggestions(new_bank.id)
+    if user_id is not None:
+        db.session.add(BankAccess(user_id, new_bank.id, permission_level))
+        db.session.commit()
+        invalidate_user_permissions(user_id)
+    return message
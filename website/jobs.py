@@ -0,0 +1,216 @@
+"""
+Background jobs. They are queued in the app's process and run by a pool of
+`JOB_WORKERS` threads; their status and progress are stored in the
+database so that any worker process can report them.
+
+Each process running jobs holds the lock of a runner token, stored with its
+jobs: once the process is gone, the lock is free, and its unfinished jobs
+are failed by `fail_abandoned_jobs` at the next startup.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import os
+import threading
+import traceback
+import uuid
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, where the app runs in a single process
+    fcntl = None
+
+from sqlalchemy import or_
+
+from .database.access import db
+from .database.models import Job
+
+# directory of the lock files of the runners
+JOB_LOCK_DIRECTORY = os.path.join(os.getcwd(), 'job-locks')
+# message of the jobs failed by an unexpected error
+JOB_ERROR_MESSAGE = 'internal error'
+
+
+class JobFailed(Exception):
+    """
+    Raised by the target of a job to end it as failed with the given
+    message (without logging a traceback).
+    """
+
+
+class JobProgress:
+    """
+    Handed to the target of a job to report its progress.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.counters = {}
+
+    def update(self, **counters):
+        self.counters.update(counters)
+        db.session.query(Job).filter(Job.id == self.job_id).update({
+            Job.progress: dict(self.counters),
+            Job.updated_at: datetime.datetime.utcnow(),
+        })
+        db.session.commit()
+
+
+# token of the current process and its held lock file, created on first use
+job_runner = None
+job_runner_lock = threading.Lock()
+
+
+def get_job_runner():
+    """
+    Returns the runner token of the current process, whose lock file is
+    held until the process exits.
+    """
+    global job_runner
+    with job_runner_lock:
+        if job_runner is None:
+            token = uuid.uuid4().hex
+            if fcntl is not None:
+                os.makedirs(JOB_LOCK_DIRECTORY, exist_ok=True)
+                file = open(os.path.join(JOB_LOCK_DIRECTORY, token + '.lock'), 'a')
+                fcntl.flock(file, fcntl.LOCK_EX)
+                job_runner = (token, file)
+            else:
+                job_runner = (token, None)
+        return job_runner[0]
+
+
+def runner_exited(token):
+    """
+    Returns `True` iff the process of the given runner token is gone (its
+    lock file is removed then).
+    """
+    if token == get_job_runner():
+        return False
+    if fcntl is None or token is None:
+        return True
+    path = os.path.join(JOB_LOCK_DIRECTORY, token + '.lock')
+    if not os.path.isfile(path):
+        return True
+    with open(path, 'a') as file:
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            # the process still runs
+            return False
+        os.remove(path)
+        return True
+
+
+def fail_abandoned_jobs():
+    """
+    Marks as failed the queued and running jobs of the processes that have
+    exited (eg on a restart of the server), and returns their number.
+    """
+    unfinished = Job.status.in_(('queued', 'running'))
+    runners = [runner for runner, in db.session.query(Job.runner).filter(unfinished).distinct()]
+    exited = [runner for runner in runners if runner_exited(runner)]
+    if not exited:
+        return 0
+    conditions = [Job.runner.in_([runner for runner in exited if runner is not None])]
+    if None in exited:
+        # jobs stored before the runner tokens
+        conditions.append(Job.runner.is_(None))
+    count = db.session.query(Job).filter(unfinished, or_(*conditions)).update({
+        Job.status: 'failed',
+        Job.message: 'interrupted',
+        Job.updated_at: datetime.datetime.utcnow(),
+    }, synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+def create_job(kind, user_id=None):
+    """
+    Stores a new queued job of the given kind, run by the current process,
+    and returns its id.
+
+    :param user_id: the user who started the job, if any
+    """
+    job = Job(kind, get_job_runner(), user_id)
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+def set_job_status(job_id, status, message=None):
+    db.session.query(Job).filter(Job.id == job_id).update({
+        Job.status: status,
+        Job.message: message,
+        Job.updated_at: datetime.datetime.utcnow(),
+    })
+    db.session.commit()
+
+
+def run_job(job_id, target, *args):
+    """
+    Runs `target(*args, progress=...)` in the current thread as the given
+    job. The value returned by `target` becomes the job's message, as does
+    the one of a `JobFailed`; other errors are only detailed in the log.
+    """
+    set_job_status(job_id, 'running')
+    try:
+        message = target(*args, progress=JobProgress(job_id))
+    except JobFailed as e:
+        db.session.rollback()
+        set_job_status(job_id, 'failed', str(e))
+        return
+    except Exception:
+        # the error may hold paths of the server
+        traceback.print_exc()
+        db.session.rollback()
+        set_job_status(job_id, 'failed', JOB_ERROR_MESSAGE)
+        return
+    set_job_status(job_id, 'done', message)
+
+
+# threads running the queued jobs, created on first use
+job_pool = None
+job_pool_lock = threading.Lock()
+
+
+def get_job_pool(app):
+    global job_pool
+    with job_pool_lock:
+        if job_pool is None:
+            job_pool = ThreadPoolExecutor(max_workers=app.config['JOB_WORKERS'], thread_name_prefix='job')
+        return job_pool
+
+
+def reset_job_runner():
+    """
+    Forgets the pool and the runner of the parent process in a forked
+    worker: the pool's threads are not inherited, and the worker's jobs
+    have their own runner.
+    """
+    global job_pool, job_pool_lock, job_runner, job_runner_lock
+    if job_runner is not None and job_runner[1] is not None:
+        # the lock stays held by the parent
+        job_runner[1].close()
+    job_pool = None
+    job_pool_lock = threading.Lock()
+    job_runner = None
+    job_runner_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=reset_job_runner)
+
+
+def start_job(app, kind, target, *args, user_id=None):
+    """
+    Queues `target(*args, progress=...)` as a new job of the given user (if
+    any), run by a background thread. Must be called within an app context;
+    returns the job's id.
+    """
+    job_id = create_job(kind, user_id)
+
+    def work():
+        with app.app_context():
+            run_job(job_id, target, *args)
+
+    get_job_pool(app).submit(work)
+    return job_id
@@ -0,0 +1,114 @@
+"""
+Hashing and verification of the passwords (bcrypt, with `BCRYPT_LOG_ROUNDS`
+as cost factor), run by a bounded pool of processes so that a burst of
+logins does not tie up the request threads' CPU time. The hashes are the
+ones of Flask-Bcrypt.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import os
+import threading
+
+import bcrypt
+from flask import current_app
+
+
+class PasswordPoolBusy(Exception):
+    """
+    Raised when `PASSWORD_QUEUE_SIZE` password operations are pending
+    already: the request should be retried later.
+    """
+    pass
+
+
+def compute_password_hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def verify_password_hash(password_hash, password):
+    if isinstance(password_hash, str):
+        password_hash = password_hash.encode('utf-8')
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), password_hash)
+    except ValueError:
+        # not a bcrypt hash
+        return False
+
+
+# processes computing the hashes, created on first use, and the number of
+# operations that may still be queued in them
+password_pool = None
+password_pool_slots = None
+password_pool_lock = threading.Lock()
+
+
+def get_password_pool(config):
+    global password_pool, password_pool_slots
+    with password_pool_lock:
+        if password_pool is None:
+            password_pool = ProcessPoolExecutor(max_workers=config['PASSWORD_WORKERS'])
+            password_pool_slots = threading.Semaphore(config['PASSWORD_QUEUE_SIZE'])
+        return password_pool, password_pool_slots
+
+
+def reset_password_pool():
+    """
+    Forgets the pool of the parent process in a forked worker (its processes
+    are not the worker's), so that the worker creates its own.
+    """
+    global password_pool, password_pool_slots, password_pool_lock
+    password_pool = None
+    password_pool_slots = None
+    password_pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=reset_password_pool)
+
+
+def run_password_operation(function, *args):
+    """
+    Returns `function(*args)`, computed by the pool (or by the current
+    thread if `PASSWORD_WORKERS` is 0). Raises `PasswordPoolBusy` if the
+    pool's queue is full.
+    """
+    global password_pool
+    if current_app.config['PASSWORD_WORKERS'] == 0:
+        return function(*args)
+    pool, slots = get_password_pool(current_app.config)
+    if not slots.acquire(blocking=False):
+        raise PasswordPoolBusy()
+    try:
+        return pool.submit(function, *args).result()
+    except BrokenProcessPool:
+        # a worker died: the pool is replaced on next use
+        with password_pool_lock:
+            if password_pool is pool:
+                password_pool = None
+        return function(*args)
+    finally:
+        slots.release()
+
+
+def hash_password(password):
+    """
+    Returns the bcrypt hash of a password, as a string.
+    """
+    return run_password_operation(compute_password_hash, password, current_app.config['BCRYPT_LOG_ROUNDS'])
+
+
+def check_password(password_hash, password):
+    """
+    Returns `True` iff the password matches the given bcrypt hash.
+    """
+    return run_password_operation(verify_password_hash, password_hash, password)
+
+
+def needs_rehash(password_hash):
+    """
+    Returns `True` iff the given hash was computed with another cost factor
+    than `BCRYPT_LOG_ROUNDS`.
+    """
+    if isinstance(password_hash, bytes):
+        password_hash = password_hash.decode('utf-8')
+    # "$2b$<rounds>$<salt and hash>"
+    return password_hash.split('$')[2:3] != [f"{current_app.config['BCRYPT_LOG_ROUNDS']:02d}"]
@@ -0,0 +1,96 @@
+from collections import deque
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over a growing set of keywords, used to find
+    all the user-selected keywords of a bank in one pass over a text.
+
+    Keywords keep their insertion order (their rank), which is the order
+    in which their matches are reported.
+    """
+
+    def __init__(self, keywords=()):
+        """
+        :param keywords: the initial keywords, in rank order
+        """
+        # state 0 is the root of the trie
+        self.transitions = [{}]
+        self.ends = [[]]
+        self.fail = [0]
+        self.outputs = [[]]
+        self.keywords = []
+        self.ranks = {}
+        self.compiled = True
+        for keyword in keywords:
+            self.add(keyword)
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def add(self, keyword):
+        """
+        Inserts `keyword` in the trie (no-op if it is already known). The
+        failure links are recomputed lazily on the next search.
+        """
+        if keyword in self.ranks:
+            return
+        rank = len(self.keywords)
+        self.ranks[keyword] = rank
+        self.keywords.append(keyword)
+        state = 0
+        for c in keyword:
+            nxt = self.transitions[state].get(c)
+            if nxt is None:
+                nxt = len(self.transitions)
+                self.transitions.append({})
+                self.ends.append([])
+                self.transitions[state][c] = nxt
+            state = nxt
+        self.ends[state].append(rank)
+        self.compiled = False
+
+    def compile(self):
+        """
+        Computes the failure links and the outputs of every state.
+        """
+        fail = [0] * len(self.transitions)
+        outputs = [list(ends) for ends in self.ends]
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, nxt in self.transitions[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and c not in self.transitions[f]:
+                    f = fail[f]
+                fail[nxt] = self.transitions[f].get(c, 0)
+                outputs[nxt].extend(outputs[fail[nxt]])
+        self.fail = fail
+        self.outputs = outputs
+        self.compiled = True
+
+    def first_matches(self, text):
+        """
+        Returns the `(start, end)` span of the first occurrence in `text` of
+        each keyword that occurs in it, ordered by keyword rank.
+        """
+        if not self.compiled:
+            self.compile()
+        transitions, fail, outputs = self.transitions, self.fail, self.outputs
+        lengths = [len(keyword) for keyword in self.keywords]
+        first = {}
+        if '' in self.ranks:
+            first[self.ranks['']] = 0
+        state = 0
+        for i, c in enumerate(text):
+            while state and c not in transitions[state]:
+                state = fail[state]
+            state = transitions[state].get(c, 0)
+            for rank in outputs[state]:
+                if rank not in first:
+                    first[rank] = i + 1 - lengths[rank]
+            if len(first) == len(lengths):
+                # every keyword has been found
+                break
+        return [(first[rank], first[rank] + lengths[rank]) for rank in sorted(first)]
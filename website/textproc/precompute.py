@@ -0,0 +1,105 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from sqlalchemy import and_
+
+from ..database.access import db
+from ..database.models import ImageSuggestion, ImageToAnnotate
+from .proc import suggestion_engine
+
+# number of descriptions handed to a worker at once
+CHUNK_SIZE = 500
+
+# engine of the worker processes, set by `init_worker`
+worker_engine = None
+
+
+def serialize_spans(spans):
+    return ';'.join(f'{start},{end}' for start, end in spans)
+
+
+def deserialize_spans(raw):
+    if not raw:
+        return []
+    spans = []
+    for part in raw.split(';'):
+        start, end = part.split(',', 1)
+        spans.append((int(start), int(end)))
+    return spans
+
+
+def init_worker(engine):
+    global worker_engine
+    worker_engine = engine
+
+
+def compute_chunk(chunk):
+    """
+    Computes the serialized spans of a chunk of `(image_id, description)`
+    pairs.
+    """
+    return [(image_id, serialize_spans(worker_engine.find_spans(description)))
+            for image_id, description in chunk]
+
+
+def precompute_bank_suggestions(bank_id, engine=suggestion_engine):
+    """
+    Computes and stores the termlist spans of every image of the bank that
+    has none for the current version of the termlists. Spans of older
+    versions are dropped.
+
+    Returns the number of images processed.
+    """
+    bank_images = db.session.query(ImageToAnnotate.id).filter(ImageToAnnotate.image_bank_id == bank_id)
+    db.session.query(ImageSuggestion) \
+        .filter(and_(ImageSuggestion.image_id.in_(bank_images),
+                     ImageSuggestion.termlist_hash != engine.version)) \
+        .delete(synchronize_session=False)
+    done = db.session.query(ImageSuggestion.image_id) \
+        .filter(ImageSuggestion.termlist_hash == engine.version)
+    todo = db.session.query(ImageToAnnotate.id, ImageToAnnotate.description) \
+        .filter(and_(ImageToAnnotate.image_bank_id == bank_id,
+                     ImageToAnnotate.id.notin_(done))) \
+        .all()
+    chunks = [todo[i:i + CHUNK_SIZE] for i in range(0, len(todo), CHUNK_SIZE)]
+    workers = current_app.config['SUGGESTION_WORKERS']
+    if len(chunks) > 1 and workers != 0:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(engine,)) as pool:
+            results = list(pool.map(compute_chunk, chunks))
+    else:
+        # not worth spawning processes
+        init_worker(engine)
+        results = [compute_chunk(chunk) for chunk in chunks]
+    for result in results:
+        db.session.execute(ImageSuggestion.__table__.insert(), [
+            {'image_id': image_id, 'termlist_hash': engine.version, 'spans': spans}
+            for image_id, spans in result
+        ])
+    db.session.commit()
+    return len(todo)
+
+
+def precomputed_spans(image_id, engine=suggestion_engine):
+    """
+    Returns the stored spans of the given image for the current version of
+    the termlists, or `None` if they have not been computed.
+    """
+    row = db.session.query(ImageSuggestion.spans) \
+        .filter(and_(ImageSuggestion.image_id == image_id,
+                     ImageSuggestion.termlist_hash == engine.version)) \
+        .first()
+    return deserialize_spans(row.spans) if row is not None else None
+
+
+def precomputed_spans_of(image_ids, engine=suggestion_engine):
+    """
+    Returns the stored spans of the given images for the current version of
+    the termlists, by image id (images whose spans have not been computed
+    are missing), in one query.
+    """
+    if not image_ids:
+        return {}
+    rows = db.session.query(ImageSuggestion.image_id, ImageSuggestion.spans) \
+        .filter(and_(ImageSuggestion.image_id.in_(image_ids),
+                     ImageSuggestion.termlist_hash == engine.version))
+    return {row.image_id: deserialize_spans(row.spans) for row in rows}
@@ -1,9 +1,26 @@
-from itertools import permutations, takewhile
+from collections import OrderedDict
+from threading import Lock
 
+from flask import current_app
 from website.database.models import UserSelectedKeyword
 from ..database.access import db
+from .automaton import KeywordAutomaton
 from sqlalchemy import and_
+import hashlib
 import os
+import re
+import time
+
+ADJ_LIST_PATH = os.path.join(os.getcwd(), 'termlist', 'adjlist.txt')
+COLOR_LIST_PATH = os.path.join(os.getcwd(), 'termlist', 'colorlist.txt')
+PATTERN_LIST_PATH = os.path.join(os.getcwd(), 'termlist', 'patternlist.txt')
+
+# kinds of a term of the termlists (a term can be both)
+ADJECTIVE = 1
+PATTERN = 2
+
+# number of banks whose user keywords are kept compiled in memory
+USER_KEYWORD_CACHE_BANKS = 64
 
 
 def load_word_list(p):
@@ -19,6 +36,168 @@ def load_word_list(p):
     return ls
 
 
+class SuggestionEngine:
+    """
+    Compiled form of the termlists: a single tokenizer plus a table
+    mapping each term to its kind(s), so that the adjective-to-pattern
+    suggestions of a description are found in one pass over it.
+    """
+    # a word starts with a letter and goes on with letters or dashes;
+    # `;` and `.` terminate a pending suggestion
+    TOKEN_REGEX = re.compile(r'[^\W\d_]+(?:-[^\W\d_]*)*|[;.]')
+    # numbers such as '²' are word characters for `re` but not letters for
+    # `str.isalpha`: they are replaced by spaces (non-ASCII only)
+    NON_ASCII_REGEX = re.compile(r'[^\x00-\x7f]')
+    # changed with the tokenization, so that the stored spans are recomputed
+    TOKENIZER_VERSION = 2
+
+    def __init__(self, adjectives, patterns):
+        """
+        :param adjectives: the (lowercase) words that can start a suggestion
+        :param patterns: the (lowercase) words that can end a suggestion
+        """
+        self.kinds = {}
+        for adjective in adjectives:
+            self.kinds[adjective] = self.kinds.get(adjective, 0) | ADJECTIVE
+        for pattern in patterns:
+            self.kinds[pattern] = self.kinds.get(pattern, 0) | PATTERN
+        # identifies the termlists and the tokenization, to know whether
+        # stored spans are stale
+        raw = '\n'.join([f'tokenizer:{self.TOKENIZER_VERSION}'] +
+                        [f'{word}:{kind}' for word, kind in sorted(self.kinds.items())])
+        self.version = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def find_spans(self, description):
+        """
+        Returns the `(start, end)` spans of `description` that go from an
+        adjective to the next pattern or terminator.
+        """
+        if not description.isascii():
+            # (same length, so that the spans hold)
+            description = self.NON_ASCII_REGEX.sub(
+                lambda match: match.group() if match.group().isalpha() else ' ', description)
+        kinds = self.kinds
+        spans = []
+        start_index = -1
+        for match in self.TOKEN_REGEX.finditer(description):
+            token = match.group()
+            if token == ';' or token == '.':
+                if start_index != -1:
+                    # termination!
+                    spans.append((start_index, match.start()))
+                    start_index = -1
+                continue
+            kind = kinds.get(token.lower(), 0)
+            # potential beginning of a description
+            if start_index == -1:
+                if kind & ADJECTIVE:
+                    start_index = match.start()
+            elif kind & PATTERN:
+                spans.append((start_index, match.end()))
+                start_index = -1
+        return spans
+
+
+# lists of words for the automatic suggestions
+adj_list = load_word_list(ADJ_LIST_PATH) + load_word_list(COLOR_LIST_PATH)
+pattern_list = load_word_list(PATTERN_LIST_PATH)
+suggestion_engine = SuggestionEngine(adj_list, pattern_list)
+
+
+class UserKeywordCache:
+    """
+    Process-level LRU cache of the user-selected keywords of the banks,
+    each compiled into a `KeywordAutomaton`.
+
+    Keywords saved by this process are written through with `add`; those
+    saved by other processes are caught up from the database (only the
+    rows newer than the last one seen) when the bank is looked up, at most
+    once every `USER_KEYWORD_SYNC_INTERVAL` seconds. Other changes (a bank
+    deleted by another process, whose ids get reused) are seen once the
+    entry expires, after `USER_KEYWORD_CACHE_TTL` seconds.
+    """
+
+    class Entry:
+        def __init__(self, expiry):
+            self.lock = Lock()
+            self.automaton = KeywordAutomaton()
+            self.last_id = 0
+            self.expiry = expiry
+            # time of the last catch-up (none yet)
+            self.synced = None
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.lock = Lock()
+        self.entries = OrderedDict()
+
+    def get(self, image_bank_id):
+        """
+        Returns the entry of the given bank, loading it (or its newest
+        keywords) from the database as needed.
+        """
+        now = time.monotonic()
+        config = current_app.config
+        with self.lock:
+            entry = self.entries.get(image_bank_id)
+            if entry is None or entry.expiry <= now:
+                entry = UserKeywordCache.Entry(now + config['USER_KEYWORD_CACHE_TTL'])
+                self.entries[image_bank_id] = entry
+                self.entries.move_to_end(image_bank_id)
+                if len(self.entries) > self.capacity:
+                    # evict the least recently viewed bank
+                    self.entries.popitem(last=False)
+            else:
+                self.entries.move_to_end(image_bank_id)
+                if entry.synced is not None and now - entry.synced < config['USER_KEYWORD_SYNC_INTERVAL']:
+                    return entry
+        rows = db.session.query(UserSelectedKeyword.id, UserSelectedKeyword.keyword) \
+            .filter(and_(UserSelectedKeyword.image_bank_id == image_bank_id,
+                         UserSelectedKeyword.id > entry.last_id)) \
+            .order_by(UserSelectedKeyword.id) \
+            .all()
+        with entry.lock:
+            for keyword_id, keyword in rows:
+                entry.automaton.add(keyword)
+                entry.last_id = max(entry.last_id, keyword_id)
+            entry.synced = now
+        return entry
+
+    def add(self, image_bank_id, keyword_id, keyword):
+        """
+        Writes a newly saved keyword through to the bank's automaton, if
+        the bank is cached.
+        """
+        with self.lock:
+            entry = self.entries.get(image_bank_id)
+        if entry is not None:
+            with entry.lock:
+                entry.automaton.add(keyword)
+                # the rows saved meanwhile by other processes, if any, are
+                # still to catch up (adding a known keyword is a no-op)
+                if keyword_id == entry.last_id + 1:
+                    entry.last_id = keyword_id
+
+    def discard(self, image_bank_id):
+        """
+        Forgets the given bank (eg when it is deleted).
+        """
+        with self.lock:
+            self.entries.pop(image_bank_id, None)
+
+    def find(self, image_bank_id, description):
+        """
+        Returns the spans of the first occurrence of each of the bank's
+        keywords in `description`, in the order the keywords were saved.
+        """
+        entry = self.get(image_bank_id)
+        with entry.lock:
+            return entry.automaton.first_matches(description.lower())
+
+
+user_keyword_cache = UserKeywordCache(USER_KEYWORD_CACHE_BANKS)
+
+
 # add keywords if it is not in the bound of user_keywords_selection list
 def add_keywords(start_index, end_index, user_keywords, keywords):
     not_in_bound = True
@@ -31,43 +210,25 @@ def add_keywords(start_index, end_index, user_keywords, keywords):
         keywords.append({'start': start_index, 'end': end_index})
 
 
-def get_keywords(adjectives, patterns, description, image_bank_id):
+def get_keywords(engine, description, image_bank_id, spans=None):
+    """
+    Returns the suggestions for `description`: the user-selected keywords
+    of the bank first, then the spans found by `engine` that do not
+    overlap them.
+
+    :param engine: the `SuggestionEngine` compiled from the termlists
+    :param spans: the spans of `engine` if already computed for this
+        description (see `precompute.py`)
+    """
     keywords = []
     user_keywords = []
-    i = 0
-
-    user_keywords_list = db.session.query(UserSelectedKeyword) \
-        .filter(and_(UserSelectedKeyword.image_bank_id == image_bank_id)) \
-        .all()
-
-    for user_keyword in user_keywords_list:
-        user_keyword = user_keyword.keyword
-        start_index = description.lower().find(user_keyword)
-        if start_index != -1:
-            end_index = start_index + len(user_keyword)
-            add_keywords(start_index, end_index, user_keywords, user_keywords)
-
-    start_index = -1
-    while i < len(description):
-        curr = description[i]
-        # beginning of a word
-        if curr.isalpha():
-            word = ''.join(list(takewhile(lambda c: c.isalpha() or c == '-', description[i:]))).lower()
-            # potential beginning of a description
-            if word in adjectives and start_index == -1:
-                start_index = i
-            elif word in patterns and start_index != -1:
-                end_index = i + len(word)
-                add_keywords(start_index, end_index, user_keywords, keywords)
-                start_index = -1
-            i += len(word)
-        elif (curr == ';' or curr == '.') and start_index != -1:
-            # termination!
-            end_index = i
-            add_keywords(start_index, end_index, user_keywords, keywords)
-            start_index = -1
-            i += 1
-        else:
-            i += 1
+
+    for start_index, end_index in user_keyword_cache.find(image_bank_id, description):
+        add_keywords(start_index, end_index, user_keywords, user_keywords)
+
+    if spans is None:
+        spans = engine.find_spans(description)
+    for start_index, end_index in spans:
+        add_keywords(start_index, end_index, user_keywords, keywords)
     all_keywords = user_keywords + keywords
     return all_keywords